@@ -3,31 +3,678 @@ Bloom Filter — memory-cheap membership with tradeoffs
 Problem: you need to answer “have I seen this key?” across billions of keys with tiny memory and some false positives allowed.
 
 Why it reshaped me: it taught me to accept and model errors deliberately (false positive rate), which is crucial at scale.
+
+Bulk paths: add_many / contains_many hash a whole batch of keys, then compute all k probe positions
+and set/test the bits with NumPy instead of a Python loop per key and per probe.
+
+Hashing: every scheme yields a pair (h1, h2) and probes (h1 + i*h2) % m (double hashing).
+"sha256-md5" is the original scheme and stays the default so existing filters keep their bit layout;
+"blake2b" gets both halves from one 128-bit digest, "xxh3" / "mmh3" are registered when installed.
+
+Persistence: save(path) writes a 64-byte header (m, k, hash scheme, item count) followed by the raw bits.
+BloomFilter.open(path) mmaps the file and uses it as bitarr directly, so opening is O(1) regardless of size
+and read-only ("r") filters opened by many processes share the same page-cache pages.
+
+ScalableBloomFilter: when the key count is unknown, stack BloomFilter slices with geometrically growing
+capacity and geometrically tightening FP rates, so the compound FP rate stays under the target.
+
+CountingBloomFilter: 4-bit saturating counters (two per byte) instead of bits, which makes remove() possible.
+Same m and k as BloomFilter for a given (n_items, fp_rate), so it costs exactly 4x the memory:
+~9.6 bits (1.2 bytes) per key for the plain filter at 1% FP vs ~38.3 bits (4.8 bytes) per key counting.
+
+BlockedBloomFilter: h1 picks one 512-bit (64-byte, cache-line sized) block and all k probes land inside it,
+so a lookup costs about one cache miss instead of k. The price is a somewhat higher FP rate for the same m.
+
+Merging: filters with identical m, k and hash scheme combine with union() (bitwise OR) / intersection() (AND).
+build_from_file() uses that to split a large key dump across a ProcessPoolExecutor: every worker fills its own
+filter directly in a multiprocessing.shared_memory block, and the parent ORs the blocks together, so no bit
+array is ever pickled.
+
+SharedBloomFilter: one filter in multiprocessing.shared_memory that a pre-fork worker fleet reads and writes
+together. Lookups never lock; adds take a striped lock around each byte they change.
 """
 
 import hashlib
 import math
+import mmap
+import multiprocessing
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from multiprocessing import shared_memory
+from operator import methodcaller
+
+import numpy as np
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import mmh3
+except ImportError:
+    mmh3 = None
+
+BATCH_SIZE = 65_536  # keys per NumPy batch in add_many / contains_many
+
+FILE_MAGIC = b"BLOOMF\x00\x01"
+COUNTING_FILE_MAGIC = b"BLOOMC\x00\x01"
+BLOCKED_FILE_MAGIC = b"BLOOMB\x00\x01"
+BLOCK_BITS = 512  # one 64-byte cache line
+HEADER = struct.Struct("<8sQQQ16s")  # magic, m, k, item count, hash scheme name
+HEADER_SIZE = 64                     # header padded so the bit array starts on a cache line
+
+
+def _digests_mod(digests: bytes, digest_size: int, m: int) -> np.ndarray:
+    """
+    Reduce concatenated big-endian digests modulo m, one uint64 per digest.
+    Horner's rule over 16-bit words keeps every intermediate below 2**64 (valid while m < 2**48),
+    so the result is bit-identical to int(hexdigest, 16) % m without creating Python big ints.
+    """
+    words = np.frombuffer(digests, dtype=">u2").reshape(-1, digest_size // 2).astype(np.uint64)
+    m = np.uint64(m)
+    acc = np.zeros(words.shape[0], dtype=np.uint64)
+    for column in words.T:
+        acc = ((acc << np.uint64(16)) | column) % m
+    return acc
+
+
+class Sha256Md5Hasher:
+    """v1 scheme: h1 from sha256, h2 from md5, both hex digests parsed as big ints."""
+    name = "sha256-md5"
+
+    def pair(self, data: bytes, m: int):
+        h1 = int(hashlib.sha256(data).hexdigest(), 16)
+        h2 = int(hashlib.md5(data).hexdigest(), 16)
+        return h1 % m, h2 % m
+
+    def pairs(self, encoded, m: int):
+        digest = methodcaller("digest")
+        h1 = _digests_mod(b"".join(map(digest, map(hashlib.sha256, encoded))), 32, m)
+        h2 = _digests_mod(b"".join(map(digest, map(hashlib.md5, encoded))), 16, m)
+        return h1, h2
+
+
+class Digest128Hasher:
+    """One 128-bit digest per key, split into two little-endian 64-bit integers."""
+
+    def __init__(self, name: str, digest_fn):
+        self.name = name
+        self.digest_fn = digest_fn  # bytes -> 16 bytes
+
+    def pair(self, data: bytes, m: int):
+        d = self.digest_fn(data)
+        return int.from_bytes(d[:8], "little") % m, int.from_bytes(d[8:], "little") % m
+
+    def pairs(self, encoded, m: int):
+        halves = np.frombuffer(b"".join(map(self.digest_fn, encoded)), dtype="<u8").reshape(-1, 2)
+        m = np.uint64(m)
+        return halves[:, 0] % m, halves[:, 1] % m
+
+
+def _blake2b_128(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+HASHERS = {
+    "sha256-md5": Sha256Md5Hasher(),
+    "blake2b": Digest128Hasher("blake2b", _blake2b_128),
+}
+if xxhash is not None:
+    HASHERS["xxh3"] = Digest128Hasher("xxh3", xxhash.xxh3_128_digest)
+if mmh3 is not None:
+    HASHERS["mmh3"] = Digest128Hasher("mmh3", mmh3.hash_bytes)
+
+DEFAULT_HASHER = "sha256-md5"  # v1 bit layout; changing it would make old filters unreadable
+
+
+def get_hasher(hasher):
+    """Resolve a scheme name (see HASHERS) or pass through an object with pair() / pairs()."""
+    if not isinstance(hasher, str):
+        return hasher
+    try:
+        return HASHERS[hasher]
+    except KeyError:
+        raise ValueError(f"unknown hasher {hasher!r}, available: {sorted(HASHERS)}") from None
+
+
+def _batches(items, size=BATCH_SIZE):
+    it = iter(items)
+    while batch := list(islice(it, size)):
+        yield batch
+
 
 class BloomFilter:
-    def __init__(self, n_items, fp_rate=0.01):
-        self.m = -int(n_items * math.log(fp_rate) / (math.log(2)**2))  # bits
-        self.k = max(1, int((self.m / n_items) * math.log(2)))       # hash functions
-        self.bitarr = bytearray((self.m + 7) // 8)
+    file_magic = FILE_MAGIC
+
+    def __init__(self, n_items, fp_rate=0.01, hasher=DEFAULT_HASHER):
+        self.m, self.k = self._optimal_size(n_items, fp_rate)
+        self.bitarr = bytearray(self._storage_bytes(self.m))
+        self.hasher = get_hasher(hasher)
+        self.count = 0  # items added (duplicates included)
+        self._mmap = None
+
+    @staticmethod
+    def _optimal_size(n_items, fp_rate):
+        m = -int(n_items * math.log(fp_rate) / (math.log(2)**2))  # bits
+        k = max(1, int((m / n_items) * math.log(2)))              # hash functions
+        return m, k
+
+    @staticmethod
+    def _storage_bytes(m):
+        return (m + 7) // 8
 
     def _hashes(self, item):
-        h1 = int(hashlib.sha256(item.encode()).hexdigest(), 16)
-        h2 = int(hashlib.md5(item.encode()).hexdigest(), 16)
+        h1, h2 = self.hasher.pair(item.encode(), self.m)
         for i in range(self.k):
             yield (h1 + i * h2) % self.m
 
     def add(self, item):
         for pos in self._hashes(item):
             self.bitarr[pos // 8] |= 1 << (pos % 8)
+        self.count += 1
 
     def __contains__(self, item):
         return all(self.bitarr[pos // 8] & (1 << (pos % 8)) for pos in self._hashes(item))
 
-# quick demo
-bf = BloomFilter(n_items=1000, fp_rate=0.01)
-bf.add("alice@example.com")
-print("alice" in bf, "bob" in bf, "alice@example.com" in bf)
\ No newline at end of file
+    def fill_ratio(self) -> float:
+        """Fraction of bits set."""
+        return int(np.bitwise_count(np.frombuffer(self.bitarr, dtype=np.uint8)).sum()) / self.m
+
+    def estimated_fp_rate(self) -> float:
+        """FP rate implied by the current fill: a miss needs all k probes to land on set bits."""
+        return self.fill_ratio() ** self.k
+
+    # --- vectorized bulk paths --- #
+
+    def _positions(self, items) -> np.ndarray:
+        """(len(items), k) array of bit positions, same values as _hashes() yields per item."""
+        h1, h2 = self.hasher.pairs([item.encode() for item in items], self.m)
+        i = np.arange(self.k, dtype=np.uint64)
+        # pairs() come back reduced mod m: (h1 + i*h2) % m is unchanged and stays inside uint64
+        return (h1[:, None] + i * h2[:, None]) % np.uint64(self.m)
+
+    def add_many(self, items):
+        """Add every string in items; equivalent to calling add() on each one."""
+        bits = np.frombuffer(self.bitarr, dtype=np.uint8)  # zero-copy, writable view of bitarr
+        if not bits.flags.writeable:
+            # ufunc.at does not check this itself and would crash writing into a read-only mmap
+            raise TypeError("cannot modify read-only memory")
+        for batch in _batches(items):
+            pos = self._positions(batch).ravel()
+            np.bitwise_or.at(bits, pos >> np.uint64(3), np.left_shift(1, pos & np.uint64(7)).astype(np.uint8))
+            self.count += len(batch)
+
+    def contains_many(self, items) -> np.ndarray:
+        """Boolean array: result[i] is (items[i] in self)."""
+        bits = np.frombuffer(self.bitarr, dtype=np.uint8)
+        results = []
+        for batch in _batches(items):
+            pos = self._positions(batch)
+            hit = (bits[pos >> np.uint64(3)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1
+            results.append(hit.all(axis=1))
+        return np.concatenate(results) if results else np.zeros(0, dtype=bool)
+
+    # --- set operations --- #
+
+    @staticmethod
+    def _union_bytes(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        return a | b
+
+    @staticmethod
+    def _intersection_bytes(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        return a & b
+
+    def _check_compatible(self, other):
+        if type(other) is not type(self) or (other.m, other.k, other.hasher.name) != (self.m, self.k, self.hasher.name):
+            raise ValueError("filters must have the same type, m, k and hash scheme to be merged")
+
+    def union(self, other):
+        """New filter answering yes for anything either filter holds; same result as adding both key sets."""
+        self._check_compatible(other)
+        merged = self._union_bytes(np.frombuffer(self.bitarr, dtype=np.uint8), np.frombuffer(other.bitarr, dtype=np.uint8))
+        return self._from_buffer(self.m, self.k, self.hasher, bytearray(merged), self.count + other.count)
+
+    def intersection(self, other):
+        """
+        New filter for keys in both filters. Its FP rate is at least that of a filter built from the common keys,
+        and count is only an upper bound.
+        """
+        self._check_compatible(other)
+        merged = self._intersection_bytes(np.frombuffer(self.bitarr, dtype=np.uint8), np.frombuffer(other.bitarr, dtype=np.uint8))
+        return self._from_buffer(self.m, self.k, self.hasher, bytearray(merged), min(self.count, other.count))
+
+    __or__ = union
+    __and__ = intersection
+
+    # --- persistence --- #
+
+    def _header(self) -> bytes:
+        return HEADER.pack(self.file_magic, self.m, self.k, self.count, self.hasher.name.encode()).ljust(HEADER_SIZE, b"\x00")
+
+    def save(self, path):
+        """Write header + bits to path; the result can be loaded with BloomFilter.open()."""
+        with open(path, "wb") as f:
+            f.write(self._header())
+            f.write(self.bitarr)
+
+    @classmethod
+    def open(cls, path, mode="r"):
+        """
+        Map a file written by save() without reading it.
+        mode="r": read-only, pages are shared between processes; add() raises.
+        mode="r+": adds go straight to the file; call flush() / close() to persist the item count.
+        """
+        if mode not in ("r", "r+"):
+            raise ValueError(f"mode must be 'r' or 'r+', got {mode!r}")
+        with open(path, "rb" if mode == "r" else "r+b") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ if mode == "r" else mmap.ACCESS_WRITE)
+        magic, m, k, count, hasher_name = HEADER.unpack_from(mm)
+        if magic != cls.file_magic:
+            mm.close()
+            raise ValueError(f"{path} is not a {cls.__name__} file")
+        bf = cls._from_buffer(m, k, hasher_name.rstrip(b"\x00").decode(),
+                              memoryview(mm)[HEADER_SIZE:HEADER_SIZE + cls._storage_bytes(m)], count)
+        bf._mmap = mm
+        return bf
+
+    @classmethod
+    def _from_buffer(cls, m, k, hasher, buffer, count=0):
+        """Filter with the given parameters whose bitarr is buffer (bytearray, mmap or shared memory view)."""
+        bf = cls.__new__(cls)
+        bf.m, bf.k, bf.count = m, k, count
+        bf.hasher = get_hasher(hasher)
+        bf.bitarr = buffer
+        bf._mmap = None
+        return bf
+
+    def flush(self):
+        if self._mmap is not None and not self.bitarr.readonly:
+            self._mmap[:HEADER_SIZE] = self._header()
+            self._mmap.flush()
+
+    def close(self):
+        """Flush and unmap a filter returned by open(); no-op for in-memory filters."""
+        if self._mmap is None:
+            return
+        self.flush()
+        self.bitarr.release()
+        self._mmap.close()
+        self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CountingBloomFilter(BloomFilter):
+    """
+    Bloom filter with deletes: bitarr holds one 4-bit counter per position, packed two per byte
+    (even positions in the low nibble). Counters saturate at 15 and are never decremented after that,
+    so a saturated position can only give a false positive, never a false negative.
+    """
+    file_magic = COUNTING_FILE_MAGIC
+    MAX_COUNT = 0xF
+
+    @staticmethod
+    def _storage_bytes(m):
+        return (m + 1) // 2
+
+    def _counter(self, pos):
+        return (self.bitarr[pos >> 1] >> ((pos & 1) << 2)) & 0xF
+
+    def add(self, item):
+        for pos in self._hashes(item):
+            if self._counter(pos) != self.MAX_COUNT:
+                self.bitarr[pos >> 1] += 1 << ((pos & 1) << 2)
+        self.count += 1
+
+    def remove(self, item):
+        """Remove one previously added item; KeyError if it is definitely not in the filter."""
+        if item not in self:
+            raise KeyError(item)
+        for pos in self._hashes(item):
+            if self._counter(pos) != self.MAX_COUNT:
+                self.bitarr[pos >> 1] -= 1 << ((pos & 1) << 2)
+        self.count -= 1
+
+    def __contains__(self, item):
+        return all(self._counter(pos) for pos in self._hashes(item))
+
+    def count_estimate(self, item) -> int:
+        """Upper bound on how many times item was added (min over its counters, capped at 15)."""
+        return min(self._counter(pos) for pos in self._hashes(item))
+
+    @staticmethod
+    def _union_bytes(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Per-nibble saturating sum, so union == adding both key sets (up to saturation)."""
+        low = np.minimum((a & 0xF) + (b & 0xF), 0xF)
+        high = np.minimum((a >> 4) + (b >> 4), 0xF)
+        return (high << 4) | low
+
+    @staticmethod
+    def _intersection_bytes(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Per-nibble minimum."""
+        return (np.minimum(a >> 4, b >> 4) << 4) | np.minimum(a & 0xF, b & 0xF)
+
+    def fill_ratio(self) -> float:
+        """Fraction of non-zero counters."""
+        counters = np.frombuffer(self.bitarr, dtype=np.uint8)
+        return int(np.count_nonzero(counters & 0xF) + np.count_nonzero(counters >> 4)) / self.m
+
+    # --- vectorized bulk paths --- #
+
+    def _counters(self, pos: np.ndarray) -> np.ndarray:
+        counters = np.frombuffer(self.bitarr, dtype=np.uint8)
+        return (counters[pos >> np.uint64(1)] >> ((pos & np.uint64(1)) << np.uint64(2)).astype(np.uint8)) & 0xF
+
+    def _update_counters(self, pos: np.ndarray, delta: int):
+        """Add delta to the counter at every position in pos (repeats accumulate), saturating at 15."""
+        counters = np.frombuffer(self.bitarr, dtype=np.uint8)
+        if not counters.flags.writeable:
+            raise TypeError("cannot modify read-only memory")
+        positions, repeats = np.unique(pos, return_counts=True)
+        # even and odd positions share bytes, so update one nibble at a time to keep byte indices unique
+        for parity in (0, 1):
+            selected = (positions & np.uint64(1)) == parity
+            idx = positions[selected] >> np.uint64(1)
+            shift = parity * 4
+            byte = counters[idx]
+            current = ((byte >> shift) & 0xF).astype(np.int64)
+            updated = np.clip(current + delta * repeats[selected], 0, self.MAX_COUNT)
+            updated[current == self.MAX_COUNT] = self.MAX_COUNT
+            counters[idx] = (byte & (0xF0 >> shift)) | (updated.astype(np.uint8) << shift)
+
+    def add_many(self, items):
+        for batch in _batches(items):
+            self._update_counters(self._positions(batch).ravel(), 1)
+            self.count += len(batch)
+
+    def remove_many(self, items):
+        """Remove every item in items; raises KeyError (removing nothing from that batch) if one is absent."""
+        for batch in _batches(items):
+            pos = self._positions(batch)
+            present = (self._counters(pos) > 0).all(axis=1)
+            if not present.all():
+                raise KeyError(batch[int(np.argmin(present))])
+            self._update_counters(pos.ravel(), -1)
+            self.count -= len(batch)
+
+    def contains_many(self, items) -> np.ndarray:
+        results = [(self._counters(self._positions(batch)) > 0).all(axis=1) for batch in _batches(items)]
+        return np.concatenate(results) if results else np.zeros(0, dtype=bool)
+
+
+class BlockedBloomFilter(BloomFilter):
+    """
+    Cache-line blocked layout: m is rounded up to whole 512-bit blocks, (h1 % m) // 512 selects the block
+    and probe i sets bit (h2 + i*step) % 512 inside it, with step odd so the k offsets are distinct.
+    Everything else (bulk paths, save/open) is inherited; only the probe positions differ.
+    """
+    file_magic = BLOCKED_FILE_MAGIC
+
+    def __init__(self, n_items, fp_rate=0.01, hasher=DEFAULT_HASHER):
+        super().__init__(n_items, fp_rate, hasher)
+        self.m = -(-self.m // BLOCK_BITS) * BLOCK_BITS
+        self.bitarr.extend(bytes(self._storage_bytes(self.m) - len(self.bitarr)))
+
+    def _hashes(self, item):
+        h1, h2 = self.hasher.pair(item.encode(), self.m)
+        base = h1 - h1 % BLOCK_BITS
+        step = (h2 >> 9) | 1
+        for i in range(self.k):
+            yield base + (h2 + i * step) % BLOCK_BITS
+
+    def _positions(self, items) -> np.ndarray:
+        h1, h2 = self.hasher.pairs([item.encode() for item in items], self.m)
+        block_bits = np.uint64(BLOCK_BITS)
+        base = h1 - h1 % block_bits
+        step = (h2 >> np.uint64(9)) | np.uint64(1)
+        i = np.arange(self.k, dtype=np.uint64)
+        return base[:, None] + (h2[:, None] + i * step[:, None]) % block_bits
+
+
+class SharedBloomFilter(BloomFilter):
+    """
+    BloomFilter whose header and bits live in a named multiprocessing.shared_memory block.
+
+    The parent calls create() before forking; workers inherit the object, or any process calls
+    attach(name, locks) to map the same block. Adds are visible to everybody immediately.
+
+    Concurrency: setting a bit is a read-modify-write of a whole byte, so two processes setting different bits
+    of the same byte at the same moment could lose one of them (a false negative). Adds therefore hold
+    locks[byte % len(locks)] while they write, and skip bytes that already have the bit, which is common
+    once the filter fills up. Lookups only read and never lock: a lookup racing an add may miss that key,
+    just as if it had run a moment earlier. attach() without locks gives unlocked adds with the race above.
+    `count` is per handle (adds made through this object), not global.
+    """
+    _shm = None
+    locks = None
+
+    @classmethod
+    def create(cls, n_items, fp_rate=0.01, hasher=DEFAULT_HASHER, name=None, n_stripes=64, mp_context=None):
+        """New block; mp_context must match the one used to start the workers that receive the locks."""
+        m, k = cls._optimal_size(n_items, fp_rate)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + cls._storage_bytes(m))
+        bf = cls._from_buffer(m, k, hasher, shm.buf[HEADER_SIZE:HEADER_SIZE + cls._storage_bytes(m)])
+        shm.buf[:HEADER_SIZE] = bf._header()
+        bf._shm = shm
+        bf.locks = [(mp_context or multiprocessing).Lock() for _ in range(n_stripes)]
+        return bf
+
+    @classmethod
+    def attach(cls, name, locks=None):
+        """Map an existing block; pass the creator's locks (inherited or handed to the Process) for safe adds."""
+        shm = shared_memory.SharedMemory(name=name, track=False)  # the creator owns unlinking
+        magic, m, k, count, hasher_name = HEADER.unpack_from(shm.buf)
+        if magic != cls.file_magic:
+            shm.close()
+            raise ValueError(f"shared memory block {name!r} does not hold a {cls.__name__}")
+        bf = cls._from_buffer(m, k, hasher_name.rstrip(b"\x00").decode(),
+                              shm.buf[HEADER_SIZE:HEADER_SIZE + cls._storage_bytes(m)])
+        bf._shm = shm
+        bf.locks = locks
+        return bf
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def add(self, item):
+        if self.locks is None:
+            return super().add(item)
+        bitarr = self.bitarr
+        for pos in self._hashes(item):
+            byte, mask = pos >> 3, 1 << (pos & 7)
+            if not bitarr[byte] & mask:
+                with self.locks[byte % len(self.locks)]:
+                    bitarr[byte] |= mask
+        self.count += 1
+
+    def add_many(self, items):
+        if self.locks is None:
+            return super().add_many(items)
+        bits = np.frombuffer(self.bitarr, dtype=np.uint8)
+        n_stripes = np.uint64(len(self.locks))
+        for batch in _batches(items):
+            pos = self._positions(batch).ravel()
+            byte = pos >> np.uint64(3)
+            mask = np.left_shift(1, pos & np.uint64(7)).astype(np.uint8)
+            missing = (bits[byte] & mask) == 0
+            byte, mask = byte[missing], mask[missing]
+            order = np.argsort(byte % n_stripes, kind="stable")
+            byte, mask = byte[order], mask[order]
+            stripes, starts = np.unique(byte % n_stripes, return_index=True)
+            for stripe, lo, hi in zip(stripes.tolist(), starts.tolist(), [*starts[1:].tolist(), len(byte)]):
+                with self.locks[stripe]:
+                    np.bitwise_or.at(bits, byte[lo:hi], mask[lo:hi])
+            self.count += len(batch)
+
+    def close(self):
+        """Drop this process's mapping; the block lives on until the creator calls unlink()."""
+        if self._shm is None:
+            return super().close()
+        self.bitarr.release()
+        self._shm.close()
+        self._shm = None
+
+    def unlink(self):
+        """Free the block once every process is done with it (creator only, call before close())."""
+        self._shm.unlink()
+
+
+def _lines_until(f, end):
+    """Keys from the lines of binary file f that start before offset end."""
+    pos = f.tell()
+    for line in f:
+        if pos >= end:
+            break
+        pos += len(line)
+        key = line.rstrip(b"\r\n")
+        if key:
+            yield key.decode()
+
+
+def _fill_from_file_range(cls, m, k, hasher_name, shm_name, path, start, end):
+    """Worker: add the lines starting in [start, end) of path to a filter living in shared memory shm_name."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        bf = cls._from_buffer(m, k, hasher_name, shm.buf[:cls._storage_bytes(m)])
+        with open(path, "rb") as f:
+            if start:
+                f.seek(start - 1)
+                f.readline()  # the line containing start - 1 belongs to the previous range
+            bf.add_many(_lines_until(f, end))
+        bf.bitarr.release()
+        return bf.count
+    finally:
+        shm.close()
+
+
+def build_from_file(path, n_items, fp_rate=0.01, hasher=DEFAULT_HASHER, workers=None, cls=BloomFilter):
+    """
+    Build a cls filter from a file with one key per line, using `workers` processes.
+    The file is split into byte ranges; each worker reads its own range and fills a private shared memory
+    block, then the parent merges the blocks with cls._union_bytes. Gives the same bits as one process would.
+    """
+    result = cls(n_items, fp_rate, hasher)
+    workers = workers or os.cpu_count()
+    size = os.path.getsize(path)
+    bounds = [size * i // workers for i in range(workers + 1)]
+    nbytes = len(result.bitarr)
+    blocks = [shared_memory.SharedMemory(create=True, size=nbytes) for _ in range(workers)]
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(_fill_from_file_range, cls, result.m, result.k, result.hasher.name,
+                                   shm.name, path, bounds[i], bounds[i + 1])
+                       for i, shm in enumerate(blocks)]
+            result.count = sum(f.result() for f in futures)
+        merged = np.frombuffer(result.bitarr, dtype=np.uint8)
+        for shm in blocks:
+            part = np.frombuffer(shm.buf, dtype=np.uint8, count=nbytes)
+            merged[:] = cls._union_bytes(merged, part)
+            del part  # shm.close() refuses while a view is alive
+        del merged
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    return result
+
+
+class ScalableBloomFilter:
+    """
+    Auto-growing Bloom filter (Almeida et al., "Scalable Bloom Filters").
+    Slice i holds initial_capacity * growth**i items at fp_rate * (1 - tightening) * tightening**i,
+    so the sum over all slices (the compound FP bound) never exceeds fp_rate.
+    Only the newest slice takes adds; lookups check newest first since recent keys are the likeliest hits.
+    """
+
+    def __init__(self, initial_capacity=1000, fp_rate=0.01, growth=2, tightening=0.5, hasher=DEFAULT_HASHER):
+        self.initial_capacity = initial_capacity
+        self.fp_rate = fp_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.hasher = get_hasher(hasher)
+        self.slices: list[BloomFilter] = []
+        self.capacities: list[int] = []
+
+    def _writable_slice(self) -> BloomFilter:
+        if not self.slices or self.slices[-1].count >= self.capacities[-1]:
+            i = len(self.slices)
+            capacity = self.initial_capacity * self.growth ** i
+            slice_fp = self.fp_rate * (1 - self.tightening) * self.tightening ** i
+            self.slices.append(BloomFilter(capacity, slice_fp, hasher=self.hasher))
+            self.capacities.append(capacity)
+        return self.slices[-1]
+
+    @property
+    def count(self) -> int:
+        return sum(s.count for s in self.slices)
+
+    def add(self, item):
+        self._writable_slice().add(item)
+
+    def __contains__(self, item):
+        return any(item in s for s in reversed(self.slices))
+
+    def add_many(self, items):
+        it = iter(items)
+        for first in it:  # only grow once there is actually an item for the new slice
+            current = self._writable_slice()
+            current.add_many([first, *islice(it, self.capacities[-1] - current.count - 1)])
+
+    def contains_many(self, items) -> np.ndarray:
+        items = list(items)
+        found = np.zeros(len(items), dtype=bool)
+        for s in reversed(self.slices):
+            pending = np.flatnonzero(~found)  # later slices only see keys not found yet
+            if not len(pending):
+                break
+            found[pending] = s.contains_many([items[i] for i in pending])
+        return found
+
+    def fill_ratio(self) -> float:
+        """Fill ratio of the slice currently taking adds."""
+        return self.slices[-1].fill_ratio() if self.slices else 0.0
+
+    def estimated_fp_rate(self) -> float:
+        """A miss is a false positive if any slice says yes."""
+        miss = 1.0
+        for s in self.slices:
+            miss *= 1 - s.estimated_fp_rate()
+        return 1 - miss
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    # quick demo
+    bf = BloomFilter(n_items=1000, fp_rate=0.01)
+    bf.add("alice@example.com")
+    print("alice" in bf, "bob" in bf, "alice@example.com" in bf)
+    print(bf.contains_many(["alice", "bob", "alice@example.com"]))
+
+    path = os.path.join(tempfile.gettempdir(), "bloom_demo.bin")
+    bf.save(path)
+    with BloomFilter.open(path) as loaded:
+        print("loaded:", loaded.m, loaded.k, loaded.count, "alice@example.com" in loaded)
+
+    sbf = ScalableBloomFilter(initial_capacity=1000, fp_rate=0.01)
+    sbf.add_many(f"user-{i}" for i in range(20_000))
+    print(f"scalable: {len(sbf.slices)} slices, {sbf.count} items, fill {sbf.fill_ratio():.2f}, "
+          f"estimated FP {sbf.estimated_fp_rate():.4f}, user-42 in: {'user-42' in sbf}")
+
+    cbf = CountingBloomFilter(n_items=1000, fp_rate=0.01)
+    cbf.add_many(["alice@example.com", "alice@example.com", "bob@example.com"])
+    cbf.remove("bob@example.com")
+    print("counting:", "bob@example.com" in cbf, cbf.count_estimate("alice@example.com"),
+          f"{len(cbf.bitarr) * 8 / 1000:.1f} bits/key vs {len(bf.bitarr) * 8 / 1000:.1f} bits/key plain")
+
+    blocked = BlockedBloomFilter(n_items=1000, fp_rate=0.01)
+    blocked.add("alice@example.com")
+    print("blocked:", "alice" in blocked, "alice@example.com" in blocked, blocked.m // BLOCK_BITS, "blocks")
@@ -0,0 +1,193 @@
+"""
+Cuckoo Filter — membership with deletes, two memory accesses per lookup
+Problem: like a Bloom filter you want "have I seen this key?" in little memory, but you also need to delete keys,
+and at low FP rates you want fewer bits per key than a Bloom filter needs.
+
+How it works (Fan et al., "Cuckoo Filter: Practically Better Than Bloom"): every key is reduced to a short
+fingerprint stored in one of two candidate buckets, i1 = hash(key) and i2 = (hash(fingerprint) - i1) mod n_buckets.
+Because i2 can be computed from i1 and the fingerprint alone (and i1 from i2 the same way), a full bucket can evict
+("kick") a resident fingerprint to its other bucket without knowing the original key. A lookup reads exactly two
+buckets. Unlike the paper's i1 ^ hash(fingerprint), the subtraction works for any bucket count, so the table is
+sized to the items instead of rounded up to a power of 2.
+
+The table is a NumPy uint8 array of bit-packed f-bit fingerprints, bucket after bucket, 0 meaning empty; f is the
+smallest width that meets fp_rate, so no bits are spent on byte alignment. Hashing reuses the BloomFilter hash
+schemes; add_many / contains_many hash and read buckets in bulk like BloomFilter's.
+"""
+import math
+import random
+
+import numpy as np
+
+from BloomFilter import _batches, get_hasher
+
+ALT_HASH_MULTIPLIER = 0x5BD1E995  # MurmurHash2 mixing constant, spreads fingerprints over bucket indexes
+MAX_LOAD = 0.95  # cuckoo tables stay insertable up to ~95% load with 4-slot buckets
+
+
+class CuckooFilter:
+    def __init__(self, n_items, fp_rate=0.01, bucket_size=4, max_kicks=500, hasher="blake2b"):
+        self.bucket_size = bucket_size
+        self.max_kicks = max_kicks
+        # FP rate ~ 2 * bucket_size / 2**f; 32 bits at most, so a slot never spans more than one 8-byte read
+        self.fingerprint_bits = max(1, math.ceil(math.log2(2 * bucket_size / fp_rate)))
+        if self.fingerprint_bits > 32:
+            raise ValueError(f"fp_rate {fp_rate} is below what 32-bit fingerprints reach "
+                             f"with {bucket_size}-slot buckets ({2 * bucket_size / 2**32:.1e})")
+        self.n_buckets = max(2, math.ceil(n_items / (bucket_size * MAX_LOAD)))
+        self._slot_mask = (1 << self.fingerprint_bits) - 1
+        self._bucket_bits = bucket_size * self.fingerprint_bits
+        self._bucket_bytes = (self._bucket_bits + 14) // 8  # a bucket may start anywhere within a byte
+        self._slot_bytes = (self.fingerprint_bits + 14) // 8
+        self._slot_shifts = range(0, self._bucket_bits, self.fingerprint_bits)
+        # a bytearray for cheap scalar slicing and NumPy views of it: table, and for bulk reads _words, where
+        # _words[k] is the little-endian uint64 starting at byte k (8 bytes of padding keep the last ones in range)
+        self._bytes = bytearray((self.n_buckets * self._bucket_bits + 7) // 8 + 8)
+        self.table = np.frombuffer(self._bytes, dtype=np.uint8)
+        self._words = np.ndarray((len(self._bytes) - 7,), dtype="<u8", buffer=self._bytes, strides=(1,))
+        self.hasher = get_hasher(hasher)
+        self.count = 0
+        self.victim = None  # (bucket, fingerprint) left over when a kick chain fails; the filter is full until a remove
+        # hash pairs are reduced mod n_buckets << fingerprint_bits, so h1 % n_buckets is a uniform bucket index
+        self._hash_range = self.n_buckets << self.fingerprint_bits
+        if self._hash_range >= 2**64 or (self.hasher.name == "sha256-md5" and self._hash_range >= 2**48):
+            # the bulk hashing paths reduce in uint64 (sha256-md5: below 2**48 only)
+            raise ValueError(f"{self.n_buckets} buckets with {self.fingerprint_bits}-bit fingerprints are too many "
+                             f"for the {self.hasher.name} hasher")
+
+    def _alt_bucket(self, bucket, fp):
+        # an involution for any n_buckets: applied to the result it gives the original bucket back
+        return (fp * ALT_HASH_MULTIPLIER - bucket) % self.n_buckets
+
+    def _locate(self, item):
+        h1, h2 = self.hasher.pair(item.encode(), self._hash_range)
+        fp = h2 % self._slot_mask + 1  # never 0, which marks an empty slot
+        i1 = h1 % self.n_buckets
+        return fp, i1, self._alt_bucket(i1, fp)
+
+    def _bucket(self, i):
+        """Fingerprints of bucket i, as a list."""
+        start = i * self._bucket_bits
+        first = start >> 3
+        bits = int.from_bytes(self._bytes[first:first + self._bucket_bytes], "little") >> (start & 7)
+        mask = self._slot_mask
+        return [(bits >> shift) & mask for shift in self._slot_shifts]
+
+    def _set_slot(self, i, j, fp):
+        start = i * self._bucket_bits + j * self.fingerprint_bits
+        first, shift = start >> 3, start & 7
+        end = first + self._slot_bytes
+        bits = int.from_bytes(self._bytes[first:end], "little")
+        bits = bits & ~(self._slot_mask << shift) | (fp << shift)
+        self._bytes[first:end] = bits.to_bytes(end - first, "little")
+
+    def _insert(self, fp, i1, i2):
+        if self.victim is not None:
+            raise RuntimeError("CuckooFilter is full")
+        for i in (i1, i2):
+            bucket = self._bucket(i)
+            if 0 in bucket:
+                self._set_slot(i, bucket.index(0), fp)
+                self.count += 1
+                return
+        i = random.choice((i1, i2))
+        for _ in range(self.max_kicks):
+            j = random.randrange(self.bucket_size)
+            kicked = self._bucket(i)[j]
+            self._set_slot(i, j, fp)
+            fp = kicked
+            i = self._alt_bucket(i, fp)
+            bucket = self._bucket(i)
+            if 0 in bucket:
+                self._set_slot(i, bucket.index(0), fp)
+                self.count += 1
+                return
+        # the homeless fingerprint stays findable; nothing more can be inserted until a remove frees a slot
+        self.victim = (i, fp)
+        self.count += 1
+
+    def add(self, item):
+        self._insert(*self._locate(item))
+
+    def __contains__(self, item):
+        fp, i1, i2 = self._locate(item)
+        if self.victim is not None and self.victim[1] == fp and self.victim[0] in (i1, i2):
+            return True
+        return fp in self._bucket(i1) or fp in self._bucket(i2)
+
+    def remove(self, item):
+        """Remove one copy of item; KeyError if it is definitely not in the filter. Only remove added items."""
+        fp, i1, i2 = self._locate(item)
+        if self.victim is not None and self.victim[1] == fp and self.victim[0] in (i1, i2):
+            self.victim = None
+            self.count -= 1
+            return
+        for i in (i1, i2):
+            bucket = self._bucket(i)
+            if fp in bucket:
+                self._set_slot(i, bucket.index(fp), 0)
+                self.count -= 1
+                self._reinsert_victim()
+                return
+        raise KeyError(item)
+
+    def _reinsert_victim(self):
+        """A slot was freed: give the homeless fingerprint another kick chain, so the filter accepts adds again."""
+        if self.victim is None:
+            return
+        i, fp = self.victim
+        self.victim = None
+        self.count -= 1
+        self._insert(fp, i, self._alt_bucket(i, fp))
+
+    def bits_per_key(self) -> float:
+        return self.table.nbytes * 8 / max(self.count, 1)
+
+    def load_factor(self) -> float:
+        return self.count / (self.n_buckets * self.bucket_size)
+
+    # --- vectorized bulk paths --- #
+
+    def _locate_many(self, items):
+        h1, h2 = self.hasher.pairs([item.encode() for item in items], self._hash_range)
+        fp = h2 % np.uint64(self._slot_mask) + np.uint64(1)
+        n = np.uint64(self.n_buckets)
+        i1 = h1 % n
+        # fp < 2**32 and the multiplier < 2**31, so the product fits in uint64
+        i2 = (fp * np.uint64(ALT_HASH_MULTIPLIER) % n + n - i1) % n
+        return fp, i1, i2
+
+    def _buckets_many(self, buckets) -> np.ndarray:
+        """(len(buckets), bucket_size) array of the fingerprints in the given buckets."""
+        offsets = (buckets[:, None] * np.uint64(self._bucket_bits)
+                   + np.arange(self.bucket_size, dtype=np.uint64) * np.uint64(self.fingerprint_bits))
+        words = self._words[(offsets >> np.uint64(3)).astype(np.intp)]
+        return (words >> (offsets & np.uint64(7))) & np.uint64(self._slot_mask)
+
+    def add_many(self, items):
+        """Hashing is vectorized; placement stays sequential because inserts depend on each other."""
+        for batch in _batches(items):
+            fp, i1, i2 = self._locate_many(batch)
+            for args in zip(fp.tolist(), i1.tolist(), i2.tolist()):
+                self._insert(*args)
+
+    def contains_many(self, items) -> np.ndarray:
+        results = []
+        for batch in _batches(items):
+            fp, i1, i2 = self._locate_many(batch)
+            found = ((self._buckets_many(i1) == fp[:, None]).any(axis=1)
+                     | (self._buckets_many(i2) == fp[:, None]).any(axis=1))
+            if self.victim is not None:
+                found |= (fp == self.victim[1]) & ((i1 == self.victim[0]) | (i2 == self.victim[0]))
+            results.append(found)
+        return np.concatenate(results) if results else np.zeros(0, dtype=bool)
+
+
+if __name__ == "__main__":
+    cf = CuckooFilter(n_items=1000, fp_rate=0.01)
+    cf.add("alice@example.com")
+    cf.add("bob@example.com")
+    print("alice" in cf, "bob@example.com" in cf, "alice@example.com" in cf)
+    cf.remove("bob@example.com")
+    print("bob@example.com" in cf, cf.contains_many(["alice@example.com", "bob@example.com"]))
+    print(f"{cf.fingerprint_bits}-bit fingerprints, {cf.n_buckets} buckets x {cf.bucket_size}")
@@ -1,84 +1,812 @@
 """
 Request coalescing (aka singleflight) groups concurrent requests for the same key so only one upstream call runs; other callers wait and get that single result. Useful when upstream is slow/expensive and many clients ask for the same missing key.
-Explanation: the example below shows a simple synchronous coalescer using a per-key in-flight map with threading.Event. The first caller starts the fetch; others wait on the event and then receive the result or exception.
+Explanation: the example below shows a simple synchronous coalescer using a per-key in-flight map of futures. The first caller starts the fetch; others wait on the same future and then receive the result or exception.
+The in-flight map is split into lock stripes by key hash, so threads missing on different keys rarely share a lock.
+AsyncRequestCoalescer is the asyncio version: the first caller starts the fetch as a Task and everyone else awaits that same Task, so the event loop is never blocked.
+Results go to a pluggable cache; TTLCache bounds it by entry count and/or bytes (LRU eviction) and expires entries after a TTL.
+Hot keys need not stall at expiry: serve_stale=True keeps answering with the expired value (within the cache's grace window)
+while exactly one background refresh runs, and refresh_ahead_beta enables XFetch-style probabilistic early refresh
+(Vattani et al., "Optimal Probabilistic Cache Stampede Prevention") so popular keys are refreshed before they expire.
+BatchingCoalescer / AsyncBatchingCoalescer go one step further (DataLoader style): distinct keys requested within a short
+window are merged into one batch_fetch_fn(keys) -> {key: value} call, e.g. one Mongo $in query instead of N find_one calls.
+Failures are coalesced too: with error_ttl set, a key whose fetch raised answers with that same exception for a short window
+instead of retrying, and the window doubles (with jitter) on every consecutive failure, so a broken upstream sees a bounded,
+decaying retry rate per key instead of the full request rate.
+Every coalescer keeps CoalescerMetrics: hit/miss/error counters plus fixed-bucket histograms of fetch latency, wait latency
+and waiters per flight (how many callers each upstream call served). snapshot() returns them as a dict with p50/p90/p99,
+prometheus_text() renders them in the Prometheus text exposition format.
+@coalesce(ttl=..., maxsize=...) puts all of this in front of any function, sync or async, in the style of functools.lru_cache:
+the key is built from the call's arguments, so concurrent calls with equal arguments share one call of the function.
 
 """
+import asyncio
+import bisect
+import functools
+import inspect
+import math
+import random
+import sys
 import threading
 import time
-from typing import Any, Callable, Dict, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+_MISSING = object()
+_KWARGS_MARK = object()  # separates positional from keyword arguments in @coalesce keys
+ERROR_CACHE_SIZE = 10_000  # failing keys remembered for negative caching, least recently failed dropped first
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+WAITER_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+
+class _CacheEntry:
+    __slots__ = ("value", "expires_at", "size", "delta")
+
+    def __init__(self, value: Any, expires_at: Optional[float], size: int, delta: float):
+        self.value = value
+        self.expires_at = expires_at  # None = never expires
+        self.size = size
+        self.delta = delta            # seconds the fetch took, used by refresh-ahead
+
+
+class TTLCache:
+    """
+    Bounded result cache with LRU eviction and per-entry TTL; every operation is O(1).
+    - maxsize: max entries, max_bytes: budget measured with sizeof (shallow sys.getsizeof by default)
+    - ttl: default seconds an entry stays valid, None = forever; set(..., ttl=) overrides per entry
+    - grace: seconds an expired entry is kept so get_entry() can still return it for stale-while-revalidate
+    Reads take no lock (single OrderedDict operations are atomic under the GIL); writes and evictions do.
+    Stats counters are updated without a lock, so under heavy threading they are approximate.
+    """
+    def __init__(self, maxsize: Optional[int] = None, max_bytes: Optional[int] = None, ttl: Optional[float] = None,
+                 grace: float = 0.0, sizeof: Callable[[Any], int] = sys.getsizeof,
+                 clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.grace = grace
+        self.sizeof = sizeof
+        self.clock = clock
+        self._data: "OrderedDict[Hashable, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = self.stale_hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Fresh value for key, or default."""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry.expires_at is not None:
+            now = self.clock()
+            if now >= entry.expires_at:
+                if now >= entry.expires_at + self.grace:
+                    self._expire(key, entry)
+                self.misses += 1
+                return default
+        self._touch(key)
+        self.hits += 1
+        return entry.value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Fresh value for key, or default, without counting a hit or miss or touching the LRU order."""
+        entry = self._data.get(key)
+        if entry is None or (entry.expires_at is not None and self.clock() >= entry.expires_at):
+            return default
+        return entry.value
+
+    def get_entry(self, key: Hashable) -> Optional[_CacheEntry]:
+        """Entry for key if fresh or expired less than grace seconds ago (compare entry.expires_at), else None."""
+        entry = self._data.get(key)
+        if entry is not None and entry.expires_at is not None:
+            now = self.clock()
+            if now >= entry.expires_at + self.grace:
+                self._expire(key, entry)
+                entry = None
+            elif now >= entry.expires_at:
+                self.stale_hits += 1
+                self._touch(key)
+                return entry
+        if entry is None:
+            self.misses += 1
+            return None
+        self._touch(key)
+        self.hits += 1
+        return entry
+
+    def _touch(self, key: Hashable):
+        try:
+            self._data.move_to_end(key)
+        except KeyError:  # evicted by a writer since we read it, the entry we hold is still good
+            pass
+
+    def _expire(self, key: Hashable, entry: _CacheEntry):
+        with self._lock:
+            if self._data.get(key) is entry:
+                self._remove(key)
+                self.expirations += 1
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, delta: float = 0.0):
+        ttl = self.ttl if ttl is None else ttl
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return  # would evict everything and still not fit
+            self._data[key] = _CacheEntry(value, None if ttl is None else self.clock() + ttl, size, delta)
+            self._bytes += size
+            while ((self.maxsize is not None and len(self._data) > self.maxsize)
+                   or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)
+
+    def _remove(self, key: Hashable) -> Any:
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+        return entry.value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram: observe() is one bisect, two increments and a min / max update, no allocation and no lock.
+    Bucket i counts values <= bounds[i] (and > bounds[i - 1]); the last bucket counts values above bounds[-1].
+    Percentiles interpolate linearly inside the bucket, narrowed to the observed min and max, so they are only as
+    precise as the bucket grid but never outside the range of what was observed.
+    """
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)  # derived, so observe() has one increment less
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        """Approximate q-quantile (0 < q <= 1)."""
+        count = self.count
+        if not count:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if n and cumulative + n >= rank:
+                lower = max(self.bounds[i - 1] if i else 0.0, self.min)
+                upper = min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+                return lower + (upper - lower) * (rank - cumulative) / n
+            cumulative += n
+        return self.max
+
+    def snapshot(self) -> Dict[str, float]:
+        count = self.count
+        return {
+            "count": count,
+            "mean": self.sum / count if count else 0.0,
+            "min": self.min if count else 0.0,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": self.max if count else 0.0,
+        }
+
+
+class CoalescerMetrics:
+    """
+    Counters and histograms of one coalescer (or several sharing one instance).
+    - hits / misses: gets answered from the cache / that had to join or start a fetch
+    - errors: fetches that raised; errors_replayed: gets answered from the negative cache (error_ttl)
+    - fetch_latency: seconds per upstream call; wait_latency: seconds a caller spent waiting on someone else's fetch
+    - waiters_per_flight: callers that joined each fetch besides the one that started it
+    Like TTLCache's stats, updates take no lock, so under heavy threading the numbers are approximate.
+    """
+    def __init__(self):
+        self.hits = self.misses = self.errors = self.errors_replayed = 0
+        self.fetch_latency = Histogram()
+        self.wait_latency = Histogram()
+        self.waiters_per_flight = Histogram(WAITER_BUCKETS)
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "fetches": self.fetch_latency.count,
+            "errors": self.errors,
+            "errors_replayed": self.errors_replayed,
+            "coalesced": int(self.waiters_per_flight.sum),
+            "waiters_per_flight": self.waiters_per_flight.snapshot(),
+            "fetch_latency": self.fetch_latency.snapshot(),
+            "wait_latency": self.wait_latency.snapshot(),
+        }
+
+
+def prometheus_text(metrics: CoalescerMetrics, prefix: str = "request_coalescer",
+                    labels: Optional[Dict[str, str]] = None) -> str:
+    """Render metrics in the Prometheus text exposition format, e.g. to serve from a /metrics handler."""
+    label_str = ",".join(f'{name}="{value}"' for name, value in (labels or {}).items())
+    lines = []
+    for name, value in (("hits", metrics.hits), ("misses", metrics.misses), ("errors", metrics.errors),
+                        ("errors_replayed", metrics.errors_replayed)):
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total{{{label_str}}} {value}")
+    for name, hist in (("fetch_seconds", metrics.fetch_latency), ("wait_seconds", metrics.wait_latency),
+                       ("waiters_per_flight", metrics.waiters_per_flight)):
+        lines.append(f"# TYPE {prefix}_{name} histogram")
+        sep = "," if label_str else ""
+        cumulative = 0
+        for bound, n in zip(hist.bounds + (float("inf"),), hist.counts):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{prefix}_{name}_bucket{{{label_str}{sep}le="{le}"}} {cumulative}')
+        lines.append(f"{prefix}_{name}_sum{{{label_str}}} {hist.sum}")
+        lines.append(f"{prefix}_{name}_count{{{label_str}}} {hist.count}")
+    return "\n".join(lines) + "\n"
+
+
+class _Failure:
+    __slots__ = ("error", "traceback", "count")
+
+    def __init__(self, error: BaseException, count: int):
+        self.error = error
+        self.traceback = error.__traceback__
+        self.count = count  # consecutive failures
+
+    def reraise(self):
+        # restore the original traceback, otherwise every replay would append to the shared one
+        raise self.error.with_traceback(self.traceback)
+
+
+class _ErrorCache:
+    """
+    Negative cache: the last exception per failing key, replayed to callers for a backoff window.
+    The window is ttl * 2**(failures - 1), capped at max_ttl, with "equal jitter" (a random 50-100% of it)
+    so keys that failed together don't all retry together. Expired windows are kept for max_ttl more,
+    so the failure count keeps growing across retries until a fetch succeeds.
+    """
+    def __init__(self, ttl: float, max_ttl: float, clock: Callable[[], float]):
+        self.ttl = ttl
+        self.max_ttl = max_ttl
+        self._cache = TTLCache(maxsize=ERROR_CACHE_SIZE, grace=max_ttl, clock=clock)
+
+    def active(self, key: Hashable) -> Optional[_Failure]:
+        """The failure of key if it is inside its backoff window, else None."""
+        entry = self._cache.get_entry(key)
+        if entry is not None and self._cache.clock() < entry.expires_at:
+            return entry.value
+        return None
+
+    def record(self, key: Hashable, error: BaseException):
+        entry = self._cache.get_entry(key)
+        count = entry.value.count + 1 if entry is not None else 1
+        window = min(self.max_ttl, self.ttl * 2 ** (count - 1))
+        self._cache.set(key, _Failure(error, count), ttl=window * (0.5 + random.random() / 2))
+
+    def clear(self, key: Hashable):
+        self._cache.pop(key)
+
+
+def _check_cache(cache: TTLCache, key: Hashable, serve_stale: bool, refresh_ahead_beta: Optional[float]) -> Tuple[Any, bool]:
+    """
+    Cache lookup for the stale / refresh-ahead modes: (value or _MISSING, start a background refresh?).
+    XFetch: refresh early once now - delta * beta * ln(U) >= expires_at, U uniform in (0, 1]. Slow fetches (large delta)
+    and larger beta start earlier; with many readers exactly one of them tends to trigger it shortly before expiry.
+    """
+    entry = cache.get_entry(key)
+    if entry is None:
+        return _MISSING, False
+    if entry.expires_at is None:
+        return entry.value, False
+    now = cache.clock()
+    if now >= entry.expires_at:
+        return (entry.value, True) if serve_stale else (_MISSING, False)
+    refresh = (refresh_ahead_beta is not None
+               and now - entry.delta * refresh_ahead_beta * math.log(1.0 - random.random()) >= entry.expires_at)
+    return entry.value, refresh
+
+
+class _Flight(Future):
+    """Future of one in-flight fetch that also counts the callers who joined it."""
+    def __init__(self):
+        super().__init__()
+        self.waiters = 0
+
 
 class RequestCoalescer:
     """
     Simple synchronous request coalescing.
     - fetch_fn: callable(key) -> value (may raise)
-    - cache optional to short-circuit hits
+    - cache: TTLCache (or an object with the same get / get_entry / peek / set); default is an unbounded TTLCache
+    - serve_stale: return an expired value still inside cache.grace and refresh it in the background
+    - refresh_ahead_beta: XFetch early refresh of fresh entries (1.0 is the usual value), None = off
+    - n_stripes: number of independently locked shards of the in-flight map
+    - error_ttl: seconds a fetch exception is cached and re-raised without calling fetch_fn, doubled per consecutive
+      failure of the key up to max_error_ttl; None = off (every get after a failure retries)
+    - metrics: CoalescerMetrics to record into (pass one instance to several coalescers to aggregate them)
     """
-    def __init__(self, fetch_fn: Callable[[str], Any]):
+    def __init__(self, fetch_fn: Callable[[str], Any], cache: Optional[TTLCache] = None,
+                 serve_stale: bool = False, refresh_ahead_beta: Optional[float] = None, n_stripes: int = 64,
+                 error_ttl: Optional[float] = None, max_error_ttl: float = 60.0,
+                 metrics: Optional[CoalescerMetrics] = None):
         self.fetch_fn = fetch_fn
-        self._inflight: Dict[str, Tuple[threading.Event, Optional[Any], Optional[BaseException]]] = {}
-        self._lock = threading.Lock()
-        self._cache: Dict[str, Any] = {}
+        # each stripe: (lock, {key: _Flight}) for the keys whose hash falls into it
+        self._stripes: List[Tuple[threading.Lock, Dict[str, _Flight]]] = [(threading.Lock(), {}) for _ in range(n_stripes)]
+        self._lock = threading.Lock()  # guards _refreshing only
+        self._cache = cache if cache is not None else TTLCache()
+        self.serve_stale = serve_stale
+        self.refresh_ahead_beta = refresh_ahead_beta
+        self._refreshing: set = set()
+        self._errors = _ErrorCache(error_ttl, max_error_ttl, self._cache.clock) if error_ttl is not None else None
+        self.metrics = metrics if metrics is not None else CoalescerMetrics()
 
     def get(self, key: str) -> Any:
-        # Fast path: cached value
-        if key in self._cache:
-            return self._cache[key]
+        if self.serve_stale or self.refresh_ahead_beta is not None:
+            value, refresh = _check_cache(self._cache, key, self.serve_stale, self.refresh_ahead_beta)
+            # while a failed refresh is backing off, keep serving the cached value without starting threads
+            if refresh and (self._errors is None or self._errors.active(key) is None):
+                self._refresh_in_background(key)
+            if value is not _MISSING:
+                self.metrics.hits += 1
+                return value
+        else:
+            # Fast path: cached value, no lock taken
+            value = self._cache.get(key, _MISSING)
+            if value is not _MISSING:
+                self.metrics.hits += 1
+                return value
+        self.metrics.misses += 1
+        return self._fetch_coalesced(key)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return self.metrics.snapshot()
 
+    def _refresh_in_background(self, key: str):
         with self._lock:
-            # If another thread is already fetching, wait for it
-            if key in self._inflight:
-                event, result, exc = self._inflight[key]
-                # Release lock then wait
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(target=self._background_refresh, args=(key,), daemon=True).start()
+
+    def _background_refresh(self, key: str):
+        try:
+            self._fetch_coalesced(key, refresh=True)
+        except Exception:
+            pass  # callers keep getting the stale value until grace runs out, then fetch themselves
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _fetch_coalesced(self, key: str, refresh: bool = False) -> Any:
+        metrics = self.metrics
+        lock, inflight = self._stripes[hash(key) % len(self._stripes)]
+        with lock:
+            future = inflight.get(key)
+            is_fetcher = future is None
+            if is_fetcher:
+                # A flight may have finished between our cache miss and taking the lock: its value (or error) is
+                # recorded before it unregisters, so look again before fetching (peek: this caller's miss is
+                # already counted). A refresh wants a new value.
+                if not refresh:
+                    value = self._cache.peek(key, _MISSING)
+                    if value is not _MISSING:
+                        return value
+                if self._errors is not None:
+                    failure = self._errors.active(key)
+                    if failure is not None:
+                        metrics.errors_replayed += 1
+                        failure.reraise()
+                # Register ourselves as the fetcher, other threads will wait on this future
+                future = inflight[key] = _Flight()
             else:
-                # Register ourselves as the fetcher
-                event = threading.Event()
-                self._inflight[key] = (event, None, None)
-                # Mark that we will fetch (other threads will wait)
-                is_fetcher = True
-                # release lock and fetch below
-                # store local reference for cleanup
-                fetch_event = event
-                # fetch outside lock
-                break_fetch = False
-                # use sentinel to indicate we will fetch
-                # (we'll use a simple control flow)
-                pass
+                future.waiters += 1
+
+        if not is_fetcher:
+            # The future is our own reference, so the fetcher's cleanup can't make us miss the result
+            start = time.monotonic()
+            try:
+                return future.result()
+            finally:
+                metrics.wait_latency.observe(time.monotonic() - start)
 
-        # If we found an existing inflight, wait until event is set
-        if key in self._inflight and not ('is_fetcher' in locals()):
-            event, result, exc = self._inflight[key]
-            event.wait()
-            # after wait, read result/exception set by fetcher
-            _, result, exc = self._inflight.get(key, (None, None, None))
-            if exc:
-                raise exc
-            return result
-
-        # The thread that reaches here is the fetcher
+        start = time.monotonic()
         try:
             value = self.fetch_fn(key)
-            # store in cache (optional)
-            self._cache[key] = value
-            with self._lock:
-                # update inflight with result
-                event, _, _ = self._inflight.get(key, (None, None, None))
-                if event:
-                    self._inflight[key] = (event, value, None)
-                    event.set()
+            delta = time.monotonic() - start
+            metrics.fetch_latency.observe(delta)
+            # cache before cleanup: a late caller finds either the running flight or, under the stripe lock, the
+            # cache entry
+            self._cache.set(key, value, delta=delta)
+            if self._errors is not None:
+                self._errors.clear(key)
+            future.set_result(value)
             return value
         except BaseException as e:
-            with self._lock:
-                event, _, _ = self._inflight.get(key, (None, None, None))
-                if event:
-                    self._inflight[key] = (event, None, e)
-                    event.set()
+            metrics.fetch_latency.observe(time.monotonic() - start)
+            metrics.errors += 1
+            # like the value, the error is recorded before cleanup so no late caller slips through to fetch_fn
+            if self._errors is not None and isinstance(e, Exception):
+                self._errors.record(key, e)
+            future.set_exception(e)
+            raise
+        finally:
+            with lock:
+                inflight.pop(key, None)
+            # joins happen under the stripe lock, so the count is final once the flight is unregistered
+            metrics.waiters_per_flight.observe(future.waiters)
+
+
+class _AsyncFlight:
+    """One in-flight async fetch and the number of callers still awaiting it."""
+    __slots__ = ("task", "waiters", "joined", "background")
+
+    def __init__(self, task: "asyncio.Task[Any]"):
+        self.task = task
+        self.waiters = 0
+        self.joined = 0  # callers that found the flight already running, for CoalescerMetrics
+        self.background = False  # started by a refresh, not cancelled when callers go away
+
+
+class AsyncRequestCoalescer:
+    """
+    asyncio request coalescing.
+    - fetch_fn: async callable(key) -> value (may raise)
+    - the fetch runs as a Task shielded from individual callers: a cancelled caller only stops waiting,
+      the fetch is cancelled when its last waiter goes away
+    - exceptions from fetch_fn are raised in every waiting caller
+    - cache, serve_stale, refresh_ahead_beta, error_ttl, metrics: same as RequestCoalescer;
+      refreshes run as background Tasks
+    """
+    def __init__(self, fetch_fn: Callable[[str], Awaitable[Any]], cache: Optional[TTLCache] = None,
+                 serve_stale: bool = False, refresh_ahead_beta: Optional[float] = None,
+                 error_ttl: Optional[float] = None, max_error_ttl: float = 60.0,
+                 metrics: Optional[CoalescerMetrics] = None):
+        self.fetch_fn = fetch_fn
+        self._inflight: Dict[str, _AsyncFlight] = {}
+        self._cache = cache if cache is not None else TTLCache()
+        self.serve_stale = serve_stale
+        self.refresh_ahead_beta = refresh_ahead_beta
+        self._errors = _ErrorCache(error_ttl, max_error_ttl, self._cache.clock) if error_ttl is not None else None
+        self.metrics = metrics if metrics is not None else CoalescerMetrics()
+
+    async def get(self, key: str) -> Any:
+        metrics = self.metrics
+        if self.serve_stale or self.refresh_ahead_beta is not None:
+            value, refresh = _check_cache(self._cache, key, self.serve_stale, self.refresh_ahead_beta)
+            if refresh and key not in self._inflight and (self._errors is None or self._errors.active(key) is None):
+                flight = self._start_flight(key)
+                flight.background = True
+                # nobody may await it, so fetch errors are consumed here instead of being logged as never retrieved
+                flight.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            if value is not _MISSING:
+                metrics.hits += 1
+                return value
+        else:
+            # Fast path: cached value
+            value = self._cache.get(key, _MISSING)
+            if value is not _MISSING:
+                metrics.hits += 1
+                return value
+        metrics.misses += 1
+
+        # No lock needed: nothing below awaits between the lookup and the registration
+        flight = self._inflight.get(key)
+        joined = flight is not None
+        if joined:
+            flight.joined += 1
+        else:
+            if self._errors is not None:
+                failure = self._errors.active(key)
+                if failure is not None:
+                    metrics.errors_replayed += 1
+                    failure.reraise()
+            flight = self._start_flight(key)
+        flight.waiters += 1
+        start = time.monotonic()
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            if joined:
+                metrics.wait_latency.observe(time.monotonic() - start)
+            flight.waiters -= 1
+            if not flight.waiters and not flight.background and not flight.task.done():
+                # every caller was cancelled, nobody wants the value any more; unregister the flight now so a
+                # newcomer starts a fresh fetch instead of joining the dying one (a task cancelled before it
+                # started never runs _fetch's cleanup either)
+                flight.task.cancel()
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                    metrics.waiters_per_flight.observe(flight.joined)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return self.metrics.snapshot()
+
+    def _start_flight(self, key: str) -> _AsyncFlight:
+        flight = self._inflight[key] = _AsyncFlight(asyncio.ensure_future(self._fetch(key)))
+        return flight
+
+    async def _fetch(self, key: str) -> Any:
+        metrics = self.metrics
+        start = time.monotonic()
+        try:
+            value = await self.fetch_fn(key)
+            delta = time.monotonic() - start
+            metrics.fetch_latency.observe(delta)
+            self._cache.set(key, value, delta=delta)
+            if self._errors is not None:
+                self._errors.clear(key)
+            return value
+        except Exception as e:
+            metrics.fetch_latency.observe(time.monotonic() - start)
+            metrics.errors += 1
+            if self._errors is not None:
+                self._errors.record(key, e)
             raise
         finally:
-            # cleanup inflight entry after notifying waiters
+            # the key may already belong to a newer flight if this one was cancelled
+            flight = self._inflight.get(key)
+            if flight is not None and flight.task is asyncio.current_task():
+                del self._inflight[key]
+                metrics.waiters_per_flight.observe(flight.joined)
+
+
+def _resolve_batch(batch: Dict[str, Any], results: Dict[str, Any], cache: TTLCache, delta: float):
+    """
+    Fan a batch result out to per-key futures: exceptions in results, and missing keys, fail that key only.
+    Anything else going wrong (results is not a dict, cache.set raises) fails the keys not resolved yet:
+    their callers wait without a timeout.
+    """
+    try:
+        for key, future in batch.items():
+            value = results.get(key, _MISSING)
+            if value is _MISSING:
+                future.set_exception(KeyError(key))
+            elif isinstance(value, BaseException):
+                future.set_exception(value)
+            else:
+                cache.set(key, value, delta=delta)
+                future.set_result(value)
+    except Exception as e:
+        for future in batch.values():
+            if not future.done():
+                future.set_exception(e)
+
+
+class BatchingCoalescer:
+    """
+    Threaded batching coalescer.
+    - batch_fetch_fn: callable(list of keys) -> {key: value}; a value may be an exception for that key,
+      a key missing from the dict raises KeyError in its callers, and if the call itself raises every caller gets it
+    - the first missing key opens a batch; it is dispatched after `window` seconds (by a timer thread),
+      or right away by the caller that brings it to max_batch_size
+    - keys already pending or in flight are joined, not requested again
+    """
+    def __init__(self, batch_fetch_fn: Callable[[List[str]], Dict[str, Any]], max_batch_size: int = 100,
+                 window: float = 0.005, cache: Optional[TTLCache] = None):
+        self.batch_fetch_fn = batch_fetch_fn
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self._cache = cache if cache is not None else TTLCache()
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}   # collected, waiting for dispatch
+        self._inflight: Dict[str, Future] = {}  # dispatched, waiting for batch_fetch_fn
+        self._timer: Optional[threading.Timer] = None
+
+    def get(self, key: str) -> Any:
+        # Fast path: cached value, no lock taken
+        value = self._cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        batch = None
+        with self._lock:
+            future = self._pending.get(key) or self._inflight.get(key)
+            if future is None:
+                future = self._pending[key] = Future()
+                if len(self._pending) >= self.max_batch_size:
+                    batch = self._take_batch()
+                elif len(self._pending) == 1:
+                    self._timer = threading.Timer(self.window, self._flush, args=(self._pending,))
+                    self._timer.daemon = True
+                    self._timer.start()
+        if batch:
+            self._run_batch(batch)
+        return future.result()
+
+    def _take_batch(self) -> Dict[str, Future]:
+        """Detach the pending batch (lock held)."""
+        batch, self._pending = self._pending, {}
+        self._inflight.update(batch)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush(self, pending: Dict[str, Future]):
+        with self._lock:
+            # the batch this timer was started for may already have been dispatched by size
+            batch = self._take_batch() if self._pending is pending else None
+        if batch:
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: Dict[str, Future]):
+        try:
+            start = time.monotonic()
+            results = self.batch_fetch_fn(list(batch))
+        except BaseException as e:
+            for future in batch.values():
+                future.set_exception(e)
+        else:
+            _resolve_batch(batch, results, self._cache, time.monotonic() - start)
+        finally:
             with self._lock:
+                for key in batch:
+                    self._inflight.pop(key, None)
+
+
+class AsyncBatchingCoalescer:
+    """
+    asyncio version of BatchingCoalescer: batch_fetch_fn is async, the window is a loop.call_later timer
+    and every batch runs as its own Task. A cancelled caller stops waiting without failing the other callers of its key.
+    """
+    def __init__(self, batch_fetch_fn: Callable[[List[str]], Awaitable[Dict[str, Any]]], max_batch_size: int = 100,
+                 window: float = 0.005, cache: Optional[TTLCache] = None):
+        self.batch_fetch_fn = batch_fetch_fn
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self._cache = cache if cache is not None else TTLCache()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()  # running batches: the loop only keeps weak references to tasks
+
+    async def get(self, key: str) -> Any:
+        # Fast path: cached value
+        value = self._cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        future = self._pending.get(key) or self._inflight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._pending[key] = loop.create_future()
+            if len(self._pending) >= self.max_batch_size:
+                self._dispatch()
+            elif len(self._pending) == 1:
+                self._timer = loop.call_later(self.window, self._dispatch)
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        batch, self._pending = self._pending, {}
+        self._inflight.update(batch)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: Dict[str, asyncio.Future]):
+        try:
+            start = time.monotonic()
+            results = await self.batch_fetch_fn(list(batch))
+        except asyncio.CancelledError:
+            for future in batch.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+        else:
+            _resolve_batch(batch, results, self._cache, time.monotonic() - start)
+        finally:
+            for key in batch:
                 self._inflight.pop(key, None)
 
 
+def _make_key(args: tuple, kwargs: Dict[str, Any]) -> tuple:
+    """Hashable key for a call; keyword order does not matter, f(1, b=2) and f(a=1, b=2) are different keys."""
+    if not kwargs:
+        return args
+    return args + (_KWARGS_MARK,) + tuple(sorted(kwargs.items()))
+
+
+def _split_key(key: tuple) -> Tuple[tuple, Dict[str, Any]]:
+    for i, part in enumerate(key):
+        if part is _KWARGS_MARK:
+            return key[:i], dict(key[i + 1:])
+    return key, {}
+
+
+def coalesce(ttl: Optional[float] = None, maxsize: Optional[int] = None, *, max_bytes: Optional[int] = None,
+             grace: float = 0.0, serve_stale: bool = False, refresh_ahead_beta: Optional[float] = None,
+             error_ttl: Optional[float] = None, max_error_ttl: float = 60.0,
+             metrics: Optional[CoalescerMetrics] = None):
+    """
+    Decorator: coalesce and cache calls of a function, like functools.lru_cache but with TTL and singleflight.
+    Works for plain and async def functions (a RequestCoalescer or an AsyncRequestCoalescer is used).
+    - arguments must be hashable; calls with equal arguments share one in-flight call and one cache entry
+    - ttl, maxsize, max_bytes, grace: TTLCache settings; the other options are passed to the coalescer
+    - @coalesce without arguments caches forever, without a size limit
+    The wrapper exposes .coalescer, .snapshot() (metrics) and .cache_clear().
+    """
+    if callable(ttl):  # used as @coalesce
+        return coalesce()(ttl)
+
+    def decorator(func):
+        cache = TTLCache(maxsize=maxsize, max_bytes=max_bytes, ttl=ttl, grace=grace)
+        options = dict(cache=cache, serve_stale=serve_stale, refresh_ahead_beta=refresh_ahead_beta,
+                       error_ttl=error_ttl, max_error_ttl=max_error_ttl, metrics=metrics)
+
+        if inspect.iscoroutinefunction(func):
+            async def fetch(key: tuple) -> Any:
+                args, kwargs = _split_key(key)
+                return await func(*args, **kwargs)
+
+            coalescer = AsyncRequestCoalescer(fetch, **options)
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                return await coalescer.get(_make_key(args, kwargs))
+        else:
+            def fetch(key: tuple) -> Any:
+                args, kwargs = _split_key(key)
+                return func(*args, **kwargs)
+
+            coalescer = RequestCoalescer(fetch, **options)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return coalescer.get(_make_key(args, kwargs))
+
+        wrapper.coalescer = coalescer
+        wrapper.snapshot = coalescer.snapshot
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
+
 # --- Example usage --- #
 
 def slow_upstream(key: str) -> str:
@@ -91,8 +819,107 @@ def worker(key: str):
     val = coalescer.get(key)
     print("Got", val)
 
+
+async def async_demo(n_callers: int = 10_000):
+    calls = 0
+
+    async def slow_async_upstream(key: str) -> str:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(1)  # simulate slow call
+        return f"value-for-{key}"
+
+    async_coalescer = AsyncRequestCoalescer(slow_async_upstream)
+    results = await asyncio.gather(*(async_coalescer.get("k1") for _ in range(n_callers)))
+    print(f"{n_callers} coroutines, {calls} upstream call, all got {results[0]!r}: {set(results) == {results[0]}}")
+
+
+def stale_demo():
+    calls = 0
+
+    def counted_upstream(key: str) -> str:
+        nonlocal calls
+        calls += 1
+        return slow_upstream(key)
+
+    swr = RequestCoalescer(counted_upstream, cache=TTLCache(ttl=1, grace=30), serve_stale=True)
+    swr.get("k1")
+    time.sleep(1.1)  # k1 is now expired but inside the grace window
+    start = time.perf_counter()
+    values = [swr.get("k1") for _ in range(100)]
+    print(f"100 gets after expiry took {time.perf_counter() - start:.4f}s (stale value served), "
+          f"{len(set(values))} distinct value, background refreshes started: {calls - 1}")
+    time.sleep(1.1)
+    print(f"after refresh: {calls} upstream calls in total, cache stats {swr._cache.stats()}")
+
+
+def batching_demo(n_threads: int = 50):
+    batches = []
+
+    def bulk_upstream(keys: List[str]) -> Dict[str, str]:
+        batches.append(len(keys))
+        time.sleep(0.05)  # one round trip for the whole batch
+        return {key: f"value-for-{key}" for key in keys}
+
+    batcher = BatchingCoalescer(bulk_upstream, max_batch_size=20, window=0.01)
+    threads = [threading.Thread(target=batcher.get, args=(f"k{i % 30}",)) for i in range(n_threads)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    print(f"{n_threads} threads asking for 30 distinct keys -> {len(batches)} upstream calls with batch sizes {batches}")
+
+
+def decorator_demo(n_threads: int = 20):
+    calls = []
+
+    @coalesce(ttl=60, maxsize=1000)
+    def load_profile(user_id: int, fields: Tuple[str, ...] = ("name",)) -> Dict[str, Any]:
+        calls.append(user_id)
+        time.sleep(0.2)  # simulate slow call
+        return {"id": user_id, "fields": fields}
+
+    threads = [threading.Thread(target=load_profile, args=(i % 2,), kwargs={"fields": ("name", "email")})
+               for i in range(n_threads)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    print(f"@coalesce: {n_threads} threads, 2 distinct argument sets -> {len(calls)} calls, "
+          f"cached: {load_profile(1, fields=('name', 'email'))}, waiters: {load_profile.snapshot()['coalesced']}")
+
+
+def outage_demo(seconds: float = 2.0):
+    calls = 0
+
+    def broken_upstream(key: str) -> str:
+        nonlocal calls
+        calls += 1
+        raise ConnectionError("upstream down")
+
+    for error_ttl in (None, 0.05):
+        calls = gets = 0
+        failing = RequestCoalescer(broken_upstream, error_ttl=error_ttl, max_error_ttl=1.0)
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            gets += 1
+            try:
+                failing.get("k1")
+            except ConnectionError:
+                pass
+            time.sleep(0.001)
+        print(f"error_ttl={error_ttl}: {gets} failing gets in {seconds}s -> {calls} upstream calls")
+
+
 if __name__ == "__main__":
-    coalescer = RequestCoalescer(slow_upstream)
+    coalescer = RequestCoalescer(slow_upstream, cache=TTLCache(maxsize=10_000, ttl=60))
     threads = [threading.Thread(target=worker, args=("k1",)) for _ in range(4)]
     for t in threads: t.start()
     for t in threads: t.join()
+    print("Cached:", coalescer.get("k1"), coalescer._cache.stats())
+    print("Metrics:", coalescer.snapshot())
+    exposition = prometheus_text(coalescer.metrics, labels={"upstream": "slow_upstream"})
+    print("\n".join(line for line in exposition.splitlines() if "_bucket" not in line))
+
+    stale_demo()
+    batching_demo()
+    decorator_demo()
+    outage_demo()
+
+    asyncio.run(async_demo())
@@ -0,0 +1,223 @@
+"""
+Benchmarks for BloomFilter.py
+1. Scalar add / `in` loop vs vectorized add_many / contains_many (per-key cost in microseconds)
+2. Hash backends: bulk add throughput and measured false-positive rate against the target
+3. Persistence: rebuilding a filter vs BloomFilter.open() on a saved (mmap'd) file
+4. Overfilling: measured FP rate of a fixed-size BloomFilter vs ScalableBloomFilter past the planned capacity
+5. Classic vs cache-line blocked layout at 10M / 100M keys: lookup throughput (end to end and probe-only,
+   i.e. with hashing excluded so the cache misses show) and measured FP rate
+6. Building from a key dump: one process vs build_from_file() across a ProcessPoolExecutor
+7. BloomFilter vs CuckooFilter: bits per key, insert rate, lookup rate and measured FP rate
+8. SharedBloomFilter: worker processes adding disjoint key ranges concurrently, checked for lost bits
+"""
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from BloomFilter import (BlockedBloomFilter, BloomFilter, HASHERS, ScalableBloomFilter, SharedBloomFilter,
+                         build_from_file)
+from CuckooFilter import CuckooFilter
+
+N_KEYS = 1_000_000
+
+
+def bench_scalar_vs_bulk(n_keys=N_KEYS, fp_rate=0.01):
+    keys = [f"user-{i}@example.com" for i in range(n_keys)]
+    probes = [f"user-{i}@example.com" for i in range(n_keys // 2, n_keys + n_keys // 2)]  # half hits, half misses
+
+    scalar = BloomFilter(n_keys, fp_rate)
+    start = time.perf_counter()
+    for key in keys:
+        scalar.add(key)
+    add_scalar = time.perf_counter() - start
+
+    start = time.perf_counter()
+    hits_scalar = sum(key in scalar for key in probes)
+    contains_scalar = time.perf_counter() - start
+
+    bulk = BloomFilter(n_keys, fp_rate)
+    start = time.perf_counter()
+    bulk.add_many(keys)
+    add_bulk = time.perf_counter() - start
+
+    start = time.perf_counter()
+    hits_bulk = int(bulk.contains_many(probes).sum())
+    contains_bulk = time.perf_counter() - start
+
+    print(f"Scalar vs bulk, {n_keys:,} keys, m={bulk.m:,} bits, k={bulk.k}")
+    print(f"add:      scalar {add_scalar / n_keys * 1e6:.2f} us/key, bulk {add_bulk / n_keys * 1e6:.2f} us/key, "
+          f"bulk is {add_scalar / add_bulk:.1f} times faster")
+    print(f"contains: scalar {contains_scalar / n_keys * 1e6:.2f} us/key, bulk {contains_bulk / n_keys * 1e6:.2f} us/key, "
+          f"bulk is {contains_scalar / contains_bulk:.1f} times faster")
+    print(f"Same bit layout: {scalar.bitarr == bulk.bitarr}, same answers: {hits_scalar == hits_bulk}")
+
+
+def bench_hashers(n_keys=N_KEYS, fp_rate=0.01):
+    keys = [f"user-{i}@example.com" for i in range(n_keys)]
+    absent = [f"absent-{i}@example.com" for i in range(n_keys)]
+    print(f"Hash backends, {n_keys:,} keys, target FP rate {fp_rate}")
+    for name in HASHERS:
+        bf = BloomFilter(n_keys, fp_rate, hasher=name)
+        start = time.perf_counter()
+        bf.add_many(keys)
+        add_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        false_positives = int(bf.contains_many(absent).sum())
+        contains_time = time.perf_counter() - start
+
+        print(f"{name:>12}: add {add_time / n_keys * 1e6:.2f} us/key, contains {contains_time / n_keys * 1e6:.2f} us/key, "
+              f"FP rate {false_positives / n_keys:.4f}")
+
+
+def bench_persistence(n_keys=N_KEYS, fp_rate=0.01):
+    keys = [f"user-{i}@example.com" for i in range(n_keys)]
+    path = os.path.join(tempfile.gettempdir(), "bloom_benchmark.bin")
+
+    start = time.perf_counter()
+    bf = BloomFilter(n_keys, fp_rate, hasher="blake2b")
+    bf.add_many(keys)
+    build_time = time.perf_counter() - start
+    bf.save(path)
+
+    start = time.perf_counter()
+    loaded = BloomFilter.open(path)
+    open_time = time.perf_counter() - start
+    all_found = bool(loaded.contains_many(keys[:1000]).all())
+    loaded.close()
+    os.remove(path)
+
+    print(f"Persistence, {n_keys:,} keys, {len(bf.bitarr) / 2**20:.1f} MiB of bits")
+    print(f"rebuild: {build_time * 1000:.1f} ms, open (mmap): {open_time * 1000:.3f} ms, keys found after open: {all_found}")
+
+
+def bench_overfill(planned=100_000, fp_rate=0.01, multiples=(1, 2, 5, 10)):
+    absent = [f"absent-{i}" for i in range(100_000)]
+    print(f"Overfilling, planned capacity {planned:,}, target FP rate {fp_rate}")
+    for multiple in multiples:
+        keys = [f"user-{i}" for i in range(planned * multiple)]
+        fixed = BloomFilter(planned, fp_rate, hasher="blake2b")
+        fixed.add_many(keys)
+        scalable = ScalableBloomFilter(planned, fp_rate, hasher="blake2b")
+        scalable.add_many(keys)
+
+        start = time.perf_counter()
+        scalable_fp = scalable.contains_many(absent).mean()
+        scalable_time = time.perf_counter() - start
+        print(f"{multiple:>3}x: fixed FP {fixed.contains_many(absent).mean():.4f} "
+              f"(estimated {fixed.estimated_fp_rate():.4f}), scalable FP {scalable_fp:.4f} "
+              f"(estimated {scalable.estimated_fp_rate():.4f}, {len(scalable.slices)} slices, "
+              f"{scalable_time / len(absent) * 1e6:.2f} us/lookup)")
+
+
+def bench_blocked(sizes=(10_000_000, 100_000_000), fp_rate=0.01, n_probes=1_000_000):
+    probes = [f"absent-{i}" for i in range(n_probes)]
+    for n_keys in sizes:
+        print(f"Classic vs blocked, {n_keys:,} keys, target FP rate {fp_rate}")
+        for cls in (BloomFilter, BlockedBloomFilter):
+            bf = cls(n_keys, fp_rate, hasher="blake2b")
+            bf.add_many(f"user-{i}" for i in range(n_keys))  # streamed, never holds all keys
+
+            start = time.perf_counter()
+            fp = bf.contains_many(probes).mean()
+            lookup_time = time.perf_counter() - start
+
+            pos = bf._positions(probes)
+            bits = np.frombuffer(bf.bitarr, dtype=np.uint8)
+            start = time.perf_counter()
+            ((bits[pos >> np.uint64(3)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1).all(axis=1)
+            probe_time = time.perf_counter() - start
+
+            print(f"{cls.__name__:>18}: {len(bf.bitarr) / 2**20:.0f} MiB, "
+                  f"lookup {n_probes / lookup_time / 1e6:.2f} M/s, probe-only {n_probes / probe_time / 1e6:.1f} M/s, "
+                  f"FP rate {fp:.4f}")
+
+
+def bench_parallel_build(n_keys=N_KEYS * 5, fp_rate=0.01, workers=os.cpu_count()):
+    path = os.path.join(tempfile.gettempdir(), "bloom_keys.txt")
+    with open(path, "w") as f:
+        f.writelines(f"user-{i}@example.com\n" for i in range(n_keys))
+
+    start = time.perf_counter()
+    single = BloomFilter(n_keys, fp_rate, hasher="blake2b")
+    with open(path) as f:
+        single.add_many(line.rstrip("\n") for line in f)
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parallel = build_from_file(path, n_keys, fp_rate, hasher="blake2b", workers=workers)
+    parallel_time = time.perf_counter() - start
+    os.remove(path)
+
+    print(f"Build from file, {n_keys:,} keys")
+    print(f"1 process: {single_time:.2f} s, {workers} workers: {parallel_time:.2f} s, "
+          f"{single_time / parallel_time:.1f} times faster, same bits: {single.bitarr == parallel.bitarr}")
+
+
+def bench_cuckoo(n_keys=900_000, fp_rates=(0.01, 0.0001)):
+    keys = [f"user-{i}@example.com" for i in range(n_keys)]
+    absent = [f"absent-{i}@example.com" for i in range(n_keys)]
+    for fp_rate in fp_rates:
+        print(f"Bloom vs cuckoo, {n_keys:,} keys, target FP rate {fp_rate}")
+        for name, f in (("BloomFilter", BloomFilter(n_keys, fp_rate, hasher="blake2b")),
+                        ("CuckooFilter", CuckooFilter(n_keys, fp_rate))):
+            start = time.perf_counter()
+            f.add_many(keys)
+            insert_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            fp = f.contains_many(absent).mean()
+            lookup_time = time.perf_counter() - start
+
+            storage_bits = len(f.bitarr) * 8 if name == "BloomFilter" else f.table.nbytes * 8
+            print(f"{name:>13}: {storage_bits / n_keys:.1f} bits/key, insert {n_keys / insert_time / 1e6:.2f} M/s, "
+                  f"lookup {n_keys / lookup_time / 1e6:.2f} M/s, FP rate {fp:.5f}")
+
+
+def _shared_worker(name, locks, start, n_keys):
+    bf = SharedBloomFilter.attach(name, locks)
+    bf.add_many(f"user-{i}" for i in range(start, start + n_keys))
+    bf.close()
+
+
+def bench_shared(n_keys=N_KEYS, fp_rate=0.01, workers=4):
+    ctx = multiprocessing.get_context()
+    bf = SharedBloomFilter.create(n_keys, fp_rate, hasher="blake2b", mp_context=ctx)
+    per_worker = n_keys // workers
+    start = time.perf_counter()
+    procs = [ctx.Process(target=_shared_worker, args=(bf.name, bf.locks, w * per_worker, per_worker))
+             for w in range(workers)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    reference = BloomFilter(n_keys, fp_rate, hasher="blake2b")
+    reference.add_many(f"user-{i}" for i in range(per_worker * workers))
+    print(f"SharedBloomFilter, {workers} processes x {per_worker:,} keys")
+    print(f"concurrent adds: {per_worker * workers / elapsed / 1e6:.2f} M keys/s (process start included), "
+          f"identical to single-process build: {bytes(bf.bitarr) == bytes(reference.bitarr)}")
+    bf.unlink()
+    bf.close()
+
+
+if __name__ == "__main__":
+    bench_scalar_vs_bulk()
+    print()
+    bench_hashers()
+    print()
+    bench_persistence()
+    print()
+    bench_overfill()
+    print()
+    bench_blocked()
+    print()
+    bench_parallel_build()
+    print()
+    bench_cuckoo()
+    print()
+    bench_shared()
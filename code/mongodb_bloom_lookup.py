@@ -0,0 +1,129 @@
+"""
+Bloom filter as a negative cache in front of MongoDB point lookups
+Problem: most existence checks (dedup, "is this uuid known?") are misses, and every miss still pays a network
+round trip plus an index probe on the server.
+
+Keep a Bloom filter of the keys that exist, built once from a projection-only scan (only the key field travels)
+and updated on every insert made through this helper. A key the filter has never seen is a definite miss and is
+answered locally; only "maybe" keys (real hits + ~fp_rate of the misses) go to the server.
+
+Caveat: the filter only knows about inserts made through BloomNegativeCache. If other clients write to the
+collection, call build() again periodically, or their new keys will be reported as missing.
+"""
+import random
+import statistics
+import time
+
+from BloomFilter import ScalableBloomFilter
+
+
+class BloomNegativeCache:
+    def __init__(self, collection, field="uuid", fp_rate=0.01, hasher="blake2b"):
+        """
+        :param collection: pymongo AsyncCollection
+        :param field: indexed key field used by find_one
+        """
+        self.collection = collection
+        self.field = field
+        self.fp_rate = fp_rate
+        self.hasher = hasher
+        self.filter = None
+        self._builds = []  # one list per running build(): keys inserted since its scan started
+        self.round_trips = 0  # find_one calls that reached the server
+        self.skipped = 0      # definite misses answered from the filter
+
+    async def build(self, batch_size=10_000):
+        """(Re)build the filter from the key field of every document."""
+        # a scalable filter keeps the FP rate as inserts push the collection past its current size
+        # the scan may miss documents inserted while it runs, so their keys are recorded and added before the swap
+        inserted = []
+        self._builds.append(inserted)
+        try:
+            capacity = max(await self.collection.estimated_document_count(), 1000)
+            bf = ScalableBloomFilter(capacity, self.fp_rate, hasher=self.hasher)
+            batch = []
+            async for doc in self.collection.find({}, {self.field: 1, "_id": 0}, batch_size=batch_size):
+                if self.field in doc:
+                    batch.append(str(doc[self.field]))
+                if len(batch) >= batch_size:
+                    bf.add_many(batch)
+                    batch = []
+            bf.add_many(batch)
+            bf.add_many(inserted)  # no await from here to the swap, so no insert can slip in between
+            self.filter = bf
+        finally:
+            self._builds.remove(inserted)
+
+    def _built_filter(self):
+        if self.filter is None:
+            raise RuntimeError("BloomNegativeCache has no filter yet, call build() first")
+        return self.filter
+
+    def _add_keys(self, keys):
+        if self.filter is None and not self._builds:
+            raise RuntimeError("BloomNegativeCache has no filter yet, call build() first")
+        if self.filter is not None:
+            self.filter.add_many(keys)
+        for inserted in self._builds:
+            inserted.extend(keys)
+
+    async def find_one(self, value, *args, **kwargs):
+        if str(value) not in self._built_filter():
+            self.skipped += 1
+            return None
+        self.round_trips += 1
+        return await self.collection.find_one({self.field: value}, *args, **kwargs)
+
+    # Keys are added before the write: if the insert fails we only get a harmless false positive,
+    # whereas adding afterwards would briefly report a stored document as missing.
+
+    async def insert_one(self, doc, *args, **kwargs):
+        self._add_keys([str(doc[self.field])] if self.field in doc else [])
+        return await self.collection.insert_one(doc, *args, **kwargs)
+
+    async def insert_many(self, docs, *args, **kwargs):
+        docs = list(docs)
+        self._add_keys([str(doc[self.field]) for doc in docs if self.field in doc])
+        return await self.collection.insert_many(docs, *args, **kwargs)
+
+
+def _percentiles(times):
+    q = statistics.quantiles(times, n=100)
+    return q[49] * 1000, q[98] * 1000  # p50, p99 in ms
+
+
+async def compare_lookups(collection, present, absent, field="uuid"):
+    """
+    Look up present + absent keys (shuffled) with plain find_one and through BloomNegativeCache,
+    then print server round trips and p50/p99 latency of both.
+    """
+    keys = list(present) + list(absent)
+    random.shuffle(keys)
+
+    times_direct = []
+    found_direct = 0
+    for key in keys:
+        start = time.perf_counter()
+        found_direct += await collection.find_one({field: key}) is not None
+        times_direct.append(time.perf_counter() - start)
+
+    cache = BloomNegativeCache(collection, field)
+    start = time.perf_counter()
+    await cache.build()
+    build_time = time.perf_counter() - start
+
+    times_cached = []
+    found_cached = 0
+    for key in keys:
+        start = time.perf_counter()
+        found_cached += await cache.find_one(key) is not None
+        times_cached.append(time.perf_counter() - start)
+
+    p50_direct, p99_direct = _percentiles(times_direct)
+    p50_cached, p99_cached = _percentiles(times_cached)
+    print(f"Bloom negative cache on {collection.name}: {len(present)} hits + {len(absent)} misses, "
+          f"filter built in {build_time:.2f} s")
+    print(f"Round trips: {len(keys)} direct vs {cache.round_trips} with filter "
+          f"({1 - cache.round_trips / len(keys):.1%} fewer), same results: {found_direct == found_cached}")
+    print(f"Latency direct: p50 {p50_direct:.3f} ms, p99 {p99_direct:.3f} ms")
+    print(f"Latency with filter: p50 {p50_cached:.3f} ms, p99 {p99_cached:.3f} ms")
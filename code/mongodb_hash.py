@@ -6,6 +6,7 @@ https://medium.com/@kanishks772/your-b-tree-index-was-never-designed-for-this-ab
 3. Populate collection with 100K documents with random uuid and data, using async mongodb driver and batch inserts (1000 documents per batch)
 4. Run 1000 queries on the collection testHashIdx to find documents by uuid and measure the time taken for each query
 5. Run 1000 queries on a collection testUuidIdx to find documents by uuid and measure the time taken for each query
+6. Run 1000 hits + 9000 misses on testHashIdx with and without a Bloom filter negative cache, compare round trips and p50/p99
 """
 
 import asyncio
@@ -14,6 +15,8 @@ import uuid
 import time
 import random
 
+from mongodb_bloom_lookup import compare_lookups
+
 async def main():
     # Connect to MongoDB
     client = AsyncMongoClient("mongodb://172.24.240.1:27017/")
@@ -77,6 +80,10 @@ async def main():
     print(f"Average query time with B-tree index: {avg_btree:.6f} seconds")
     print(f"Performance difference: {avg_btree / avg_hash:.2f}x faster with hashed index" if avg_hash < avg_btree else f"Performance difference: {avg_hash / avg_btree:.2f}x faster with B-tree index")
 
+    # Mostly-miss workload with and without a Bloom filter in front of the hashed index
+    absent_uuids = [str(uuid.uuid4()) for _ in range(9000)]
+    await compare_lookups(collection_hash, query_uuids, absent_uuids)
+
     # Close the client
     await client.close()
 
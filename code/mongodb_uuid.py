@@ -8,6 +8,7 @@ Based on https://medium.com/@kanishks772/your-b-tree-index-was-never-designed-fo
 5. Populate collection with 100K documents with random uuid and data
 6. Run 1000 queries on both collections to find documents by uuid and measure the time taken for each query
 7. Compare the average query time for both collections to demonstrate the performance difference between indexed and non-indexed queries on the uuid field.
+8. Run 1000 hits + 9000 misses on the indexed collection with and without a Bloom filter negative cache, compare round trips and p50/p99
 """
 
 import asyncio
@@ -16,6 +17,8 @@ import uuid
 import time
 import random
 
+from mongodb_bloom_lookup import compare_lookups
+
 async def main():
     # Connect to MongoDB
     client = AsyncMongoClient("mongodb://172.24.240.1:27017/")
@@ -72,6 +75,10 @@ async def main():
     print(f"Average query time without index: {avg_no_idx:.6f} seconds")
     print(f"Performance difference: {avg_no_idx / avg_idx:.2f}x faster with index")
 
+    # Mostly-miss workload with and without a Bloom filter in front of the indexed collection
+    absent_uuids = [str(uuid.uuid4()) for _ in range(9000)]
+    await compare_lookups(collection_idx, query_uuids, absent_uuids)
+
     # Close the client
     client.close()
 
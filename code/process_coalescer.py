@@ -0,0 +1,198 @@
+"""
+Cross-process request coalescing for pre-fork servers (gunicorn, uwsgi, multiprocessing pools)
+Problem: RequestCoalescer only coalesces threads of one process. With 16 worker processes a cold key still
+costs 16 upstream fetches, one per process, and every process keeps its own copy of the value.
+
+ProcessCoalescer elects one fetcher per key across all processes of a host and shares the value:
+- election: POSIX byte-range locks (fcntl.lockf) on one lock file; the key's stable hash picks the byte to lock,
+  so keys are striped over n_stripes bytes. The kernel drops a dead process's locks, so a crashed fetcher
+  never wedges the others, and no Manager process or shared-memory bookkeeping is needed.
+- store: a SQLite database in WAL mode (readers never block the writer) holding pickled values with a
+  wall-clock expiry; processes that lose the election wait on the lock and then read the value from it.
+- in front of both sits a per-process RequestCoalescer with a short-lived TTLCache, so threads of one process
+  are coalesced in memory and hot keys don't touch SQLite on every get.
+Byte-range locks belong to the process, not the thread, so each stripe also has a threading.Lock:
+otherwise two threads of one process would both "own" the stripe and the first unlock would release it for both.
+POSIX only; pre-fork servers are too.
+"""
+import fcntl
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Callable, Optional
+
+from REquestCoalescer import CoalescerMetrics, RequestCoalescer, TTLCache
+
+_MISSING = object()
+
+
+class SQLiteStore:
+    """
+    Shared key -> value store for the processes of one host: SQLite in WAL mode, values pickled.
+    Connections are per thread and per process, opened on first use: SQLite forbids using a connection across a
+    fork, so a store created before a pre-fork server forks (gunicorn --preload) holds none (the schema is set up
+    through a connection closed right away), and a connection inherited anyway is never used or closed in the child.
+    Expired rows are ignored on read and purged on about 1% of writes.
+    """
+    def __init__(self, path: str, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.clock = clock  # wall clock: monotonic clocks are not comparable between processes
+        self._local = threading.local()
+        self._inherited = []  # parents' connections, referenced so they are never finalized (closed) here
+        db = sqlite3.connect(path, timeout=30, isolation_level=None)  # autocommit
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)")
+        finally:
+            db.close()
+
+    def _connection(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")  # WAL + NORMAL: durable except on power loss
+            if getattr(local, "pid", None) is not None:
+                self._inherited.append(local.db)
+            local.db, local.pid = db, os.getpid()
+        return local.db
+
+    def get(self, key: str, default: Any = None) -> Any:
+        row = self._connection().execute("SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+                                         (key, self.clock())).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: float):
+        db = self._connection()
+        now = self.clock()
+        db.execute("INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                   (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), now + ttl))
+        if random.random() < 0.01:
+            db.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            if self._local.pid == os.getpid():
+                db.close()
+            else:
+                self._inherited.append(db)
+        self._local = threading.local()
+
+
+class ProcessCoalescer:
+    """
+    Singleflight across the processes of one host.
+    - fetch_fn: callable(key) -> value (may raise); the value must be picklable
+    - path: base path shared by all processes: path + ".db" is the store, path + ".lock" the election file
+    - ttl: seconds a fetched value stays in the shared store
+    - local_ttl: seconds a process keeps a value in memory; a process may serve a value up to local_ttl
+      past its store expiry, in exchange for not querying SQLite on every get
+    - n_stripes: keys hashing to the same stripe share an election lock (and may wait for each other)
+    - error_ttl, max_error_ttl, metrics: passed to the per-process RequestCoalescer
+    Failures are not shared: if the elected fetcher raises, the next process in line fetches itself.
+    """
+    def __init__(self, fetch_fn: Callable[[str], Any], path: str, ttl: float = 60.0, local_ttl: float = 1.0,
+                 local_maxsize: Optional[int] = 10_000, n_stripes: int = 4096,
+                 error_ttl: Optional[float] = None, max_error_ttl: float = 60.0,
+                 metrics: Optional[CoalescerMetrics] = None):
+        self.fetch_fn = fetch_fn
+        self.ttl = ttl
+        self.n_stripes = n_stripes
+        self.store = SQLiteStore(path + ".db")
+        self.lock_path = path + ".lock"
+        self._lock_fd = None
+        self._lock_pid = None
+        self._lock_fd_lock = threading.Lock()  # one reopen per process, however many threads race for it
+        self._thread_locks = [threading.Lock() for _ in range(n_stripes)]
+        self.upstream_fetches = 0  # fetch_fn calls made by this process
+        self.store_hits = 0        # values this process got from another process through the store
+        self._coalescer = RequestCoalescer(self._fetch_shared, cache=TTLCache(maxsize=local_maxsize, ttl=local_ttl),
+                                           error_ttl=error_ttl, max_error_ttl=max_error_ttl, metrics=metrics)
+        self.metrics = self._coalescer.metrics
+
+    def get(self, key: str) -> Any:
+        return self._coalescer.get(key)
+
+    def snapshot(self):
+        return {**self._coalescer.snapshot(), "upstream_fetches": self.upstream_fetches,
+                "store_hits": self.store_hits}
+
+    def _lock_file(self) -> int:
+        # reopened after fork: locks taken through an inherited descriptor would be the parent's
+        if self._lock_pid != os.getpid():
+            with self._lock_fd_lock:
+                if self._lock_pid != os.getpid():
+                    self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+                    self._lock_pid = os.getpid()
+        return self._lock_fd
+
+    def _fetch_shared(self, key: str) -> Any:
+        # already fetched by another process?
+        value = self.store.get(key, _MISSING)
+        if value is not _MISSING:
+            self.store_hits += 1
+            return value
+
+        # crc32, not hash(): str hashes are randomized per process, every process must pick the same byte
+        stripe = zlib.crc32(key.encode()) % self.n_stripes
+        fd = self._lock_file()
+        with self._thread_locks[stripe]:
+            fcntl.lockf(fd, fcntl.LOCK_EX, 1, stripe)  # blocks while another process fetches this stripe
+            try:
+                # we may have waited for exactly this key's fetch
+                value = self.store.get(key, _MISSING)
+                if value is not _MISSING:
+                    self.store_hits += 1
+                    return value
+                self.upstream_fetches += 1
+                value = self.fetch_fn(key)
+                self.store.set(key, value, self.ttl)
+                return value
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, 1, stripe)
+
+    def close(self):
+        self.store.close()
+        if self._lock_fd is not None and self._lock_pid == os.getpid():
+            os.close(self._lock_fd)
+        self._lock_fd = self._lock_pid = None
+
+
+# --- Example usage --- #
+
+def slow_upstream(key: str) -> str:
+    time.sleep(1)  # simulate slow call
+    return f"value-for-{key}"
+
+
+def worker_process(path: str, key: str, upstream_calls, start_barrier):
+    coalescer = ProcessCoalescer(slow_upstream, path)
+    start_barrier.wait()
+    value = coalescer.get(key)
+    with upstream_calls.get_lock():
+        upstream_calls.value += coalescer.upstream_fetches
+    print(f"pid {os.getpid()}: {value!r}, fetched upstream: {bool(coalescer.upstream_fetches)}")
+    coalescer.close()
+
+
+if __name__ == "__main__":
+    import multiprocessing
+    import tempfile
+
+    n_processes = 16
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "coalescer")
+        ProcessCoalescer(slow_upstream, path).close()  # create the schema before the workers race for it
+        upstream_calls = multiprocessing.Value("i", 0)
+        start_barrier = multiprocessing.Barrier(n_processes)
+        start = time.perf_counter()
+        procs = [multiprocessing.Process(target=worker_process, args=(path, "k1", upstream_calls, start_barrier))
+                 for _ in range(n_processes)]
+        for p in procs: p.start()
+        for p in procs: p.join()
+        print(f"{n_processes} processes, cold key: {upstream_calls.value} upstream call(s) "
+              f"in {time.perf_counter() - start:.2f}s")
@@ -1,40 +1,488 @@
 """
 Class to limit rate per user per time
+Two modes:
+- "log" (default): exact sliding log, a deque with the timestamp of every allowed request per user.
+  Memory grows with rateLimit: ~8 bytes of deque slot + 24 bytes of float per timestamp.
+- "counter": approximate sliding window counter (as described by Cloudflare), O(1) memory per user.
+  Time is cut into fixed windows of timeWindow seconds; per user only the current window's index and the
+  request counts of the current and the previous window are kept. The number of requests in the last
+  timeWindow seconds is estimated as prevCount * (part of the previous window still inside it) + currCount.
+Accuracy of "counter" vs "log": the estimate assumes the previous window's requests were spread evenly, so the
+counter is not exact. Measured by rate_limiter_benchmark.py at 100 per 60s: under steady load it allows within ~1% as
+many requests as the log in total, but some single 60s stretches get up to ~14% more than the limit. When a window's
+requests are bunched at its end the next window underestimates them: up to ~2x the limit in bursty traffic,
+which is the worst case. Bunched at the start, the estimate is too high and requests are denied early.
+Memory at 1M users (one request each, key string and dict entry included): ~170 bytes/user for "counter",
+~870 for "log"; a "log" user at 1000 requests per minute holds ~33 KB.
+Use "log" where the limit must be exact, "counter" for many users.
+
+GCRALimiter is a third backend for burst-tolerant limits (generic cell rate algorithm, equivalent to a token bucket):
+requests are paced at one per timeWindow / rateLimit seconds, and up to `burst` of them may arrive at once.
+The only state per key is one float, the "theoretical arrival time" (TAT) at which the key would be
+back to its sustained rate. allow() reads the clock once and is a handful of float operations; retry_after()
+tells the caller how long to wait, e.g. for a Retry-After header.
+
+Both limiters keep their per-key state in a _KeyTable, so keys of users who went away don't pile up forever
+(scrapers with random IDs would otherwise grow it without bound). It is a generation-based sweep: every
+idleTimeout seconds the current generation of keys becomes the previous one and a new, empty one starts; a key
+that is used again moves back into the current generation. Keys still in the previous generation at the next
+rotation have been idle for at least idleTimeout; they are handed to a drain queue which every decision works
+off a few entries at a time (SWEEP_BATCH), dropping those whose state has run out. No decision ever pays for
+more than a few keys, and a key is only forgotten once forgetting it changes no decision.
+maxKeys caps the number of tracked keys; when a new key arrives at the cap, overflow decides:
+"reject" denies its requests (fail closed), "allow" lets them through untracked (fail open),
+"evict" drops a key to make room, preferring the longest-idle generations.
+
+All limiters share one interface: allow(key, cost=1) -> bool and retry_after(key, cost=1) -> seconds
+(RateLimiter.addRequest is allow under its original name). AsyncRateLimiter builds on it for asyncio clients:
+`await limiter.acquire(key, cost)` waits until the request fits instead of returning False. Waiters of a key
+queue up FIFO and are woken by one loop timer set to exactly the retry_after of the queue head, so pacing
+outbound calls at the maximum allowed rate needs no polling.
+
+RateLimiter and GCRALimiter are not thread-safe: addRequest checks the count and then appends, and a thread switch
+in between lets both threads through. ShardedRateLimiter makes any of them safe for thread pools without one global
+lock: keys are spread by hash over nStripes independent limiters, each behind its own lock, so threads only contend
+when their keys share a stripe.
 """
+import asyncio
+import math
+import threading
 import time
-from collections import deque, defaultdict
+from collections import deque
+
+SWEEP_BATCH = 4  # idle keys examined per decision; must exceed the 1 key a decision can add, so draining keeps up
+OVERFLOW_POLICIES = ("reject", "allow", "evict")
+MIN_DELAY = 1e-6  # floor of AsyncRateLimiter timers: a slot opening exactly "now" is retried, not spun on
+
+
+class _WindowCounter:
+    __slots__ = ("window", "prevCount", "currCount")
+
+    def __init__(self, window: int):
+        self.window = window  # index of the current fixed window: int(now // timeWindow)
+        self.prevCount = 0
+        self.currCount = 0
+
+
+class _KeyTable:
+    """
+    Per-key limiter state with generation-based eviction of idle keys (see the module docstring).
+    - isIdle(state, now): True once the state no longer affects any decision
+    Lookups go through get() / add(); the owner calls sweep(now) once per decision. Limiters inline the common
+    case of both (key in the current generation, nothing to rotate or drain) to keep decisions cheap.
+    """
+
+    def __init__(self, idleTimeout: float, isIdle, maxKeys: int = None, overflow: str = "reject"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy {overflow!r}, expected one of {OVERFLOW_POLICIES}")
+        self.idleTimeout = idleTimeout
+        self.isIdle = isIdle
+        self.maxKeys = maxKeys
+        self.overflow = overflow
+        self.current = {}
+        self.previous = {}
+        self.draining = []  # older generations, examined SWEEP_BATCH entries per decision
+        self.nextRotation = float("-inf")
+        self.evicted = 0  # keys dropped as idle or to make room
+
+    def get(self, key):
+        state = self.current.get(key)
+        if state is None:
+            state = self.previous.pop(key, None)
+            if state is None:
+                for generation in self.draining:
+                    state = generation.pop(key, None)
+                    if state is not None:
+                        break
+                else:
+                    return None
+            self.current[key] = state
+        return state
+
+    def add(self, key, state) -> bool:
+        """Start tracking a new key; False if it is over maxKeys and the overflow policy is not "evict"."""
+        if self.maxKeys is not None and len(self) >= self.maxKeys:
+            if self.overflow != "evict":
+                return False
+            self._evictOne()
+        self.current[key] = state
+        return True
+
+    def rejectsNew(self) -> bool:
+        """True if a key that is not tracked yet would be refused (maxKeys reached, overflow "reject")."""
+        return self.overflow == "reject" and self.maxKeys is not None and len(self) >= self.maxKeys
+
+    def __getitem__(self, key):
+        state = self.get(key)
+        if state is None:
+            raise KeyError(key)
+        return state
+
+    def __contains__(self, key) -> bool:
+        return (key in self.current or key in self.previous
+                or any(key in generation for generation in self.draining))
+
+    def __len__(self) -> int:
+        return len(self.current) + len(self.previous) + sum(map(len, self.draining))
+
+    def sweep(self, now: float):
+        if now >= self.nextRotation:
+            if self.previous:
+                self.draining.append(self.previous)
+            self.previous, self.current = self.current, {}
+            self.nextRotation = now + self.idleTimeout
+        if self.draining:
+            self._drain(now)
+
+    def _drain(self, now: float):
+        draining = self.draining
+        for _ in range(SWEEP_BATCH):
+            while not draining[0]:  # emptied, possibly by get() moving its keys back
+                draining.pop(0)
+                if not draining:
+                    return
+            key, state = draining[0].popitem()
+            if self.isIdle(state, now):
+                self.evicted += 1
+            else:
+                self.current[key] = state  # still limited, checked again a generation later
+
+    def _evictOne(self):
+        # oldest generation first; within the current one the choice is arbitrary (and that key's limit resets)
+        for generation in self.draining + [self.previous, self.current]:
+            if generation:
+                generation.popitem()
+                self.evicted += 1
+                break
+
 
 class RateLimiter ():
 
-    def __init__(self, rateLimit: int, timeWindow: int):
+    def __init__(self, rateLimit: int, timeWindow: int, mode: str = "log", clock=time.time,
+                 idleTimeout: float = None, maxKeys: int = None, overflow: str = "reject"):
         """
         :param rateLimit: Number requests
         :param timeWindow: time period in secs
+        :param mode: "log" (exact, memory per request) or "counter" (approximate, constant memory per user)
+        :param clock: time source, seconds
+        :param idleTimeout: generation length of the idle-key sweep, default 2 * timeWindow
+        :param maxKeys: max users tracked, None = unlimited
+        :param overflow: what happens to a new user at maxKeys: "reject", "allow" or "evict"
         """
-        self.userDict = defaultdict(deque)
+        if mode not in ("log", "counter"):
+            raise ValueError(f"unknown mode {mode!r}, expected 'log' or 'counter'")
         self.rateLimit = rateLimit
         self.timeWindow = timeWindow
+        self.mode = mode
+        self.clock = clock
+        # a log is spent once its newest timestamp left the window, a counter once two windows have passed
+        isIdle = self._logIdle if mode == "log" else self._counterIdle
+        self.userDict = _KeyTable(2 * timeWindow if idleTimeout is None else idleTimeout, isIdle, maxKeys, overflow)
 
-    def addRequest(self, userName: str) -> bool:
+    def _logIdle(self, timestamps, now: float) -> bool:
+        return not timestamps or timestamps[-1] < now - self.timeWindow
+
+    def _counterIdle(self, counter, now: float) -> bool:
+        return counter.window + 2 <= int(now / self.timeWindow)
+
+    def addRequest(self, userName: str, cost: int = 1) -> bool:
         """
         try to add request to user queue
         :param userName:
+        :param cost: number of requests this one counts as
         :return: Request allowed or not
         """
+        if cost < 1:
+            raise ValueError(f"cost must be at least 1, got {cost}")
+        if cost > self.rateLimit:
+            raise ValueError(f"cost {cost} can never be allowed with rateLimit {self.rateLimit}")
+        now = self.clock()
+        table = self.userDict
+        if now >= table.nextRotation or table.draining:
+            table.sweep(now)
+        if self.mode == "counter":
+            return self._addCounted(userName, now, cost)
 
+        timestamps = table.current.get(userName) or table.get(userName)
+        if timestamps is None:
+            timestamps = deque()
+            if not self.userDict.add(userName, timestamps):
+                return self.userDict.overflow == "allow"
         # remove timestamps older than time window
-        while self.userDict[userName] and self.userDict[userName][0] < (time.time() - self.timeWindow):
-            self.userDict[userName].popleft()
+        while timestamps and timestamps[0] < now - self.timeWindow:
+            timestamps.popleft()
 
-        if len(self.userDict[userName]) < self.rateLimit:
-            self.userDict[userName].append(time.time())
+        if len(timestamps) + cost <= self.rateLimit:
+            if cost == 1:
+                timestamps.append(now)
+            else:
+                timestamps.extend([now] * cost)
             return True
         else:
             return False
 
-rateLimitTest = RateLimiter(3, 5)
+    allow = addRequest  # the interface shared with GCRALimiter
+
+    def retry_after(self, userName: str, cost: int = 1) -> float:
+        """
+        :return: seconds until addRequest(userName, cost) would succeed, 0.0 if it would succeed now,
+            math.inf if userName is refused as over maxKeys (unknown: it depends on other keys going idle)
+        """
+        if cost < 1:
+            raise ValueError(f"cost must be at least 1, got {cost}")
+        if cost > self.rateLimit:
+            raise ValueError(f"cost {cost} can never be allowed with rateLimit {self.rateLimit}")
+        now = self.clock()
+        state = self.userDict.get(userName)
+        if state is None:
+            return math.inf if self.userDict.rejectsNew() else 0.0
+        if self.mode == "counter":
+            return self._counterRetryAfter(state, now, cost)
+        # the oldest len + cost - rateLimit timestamps have to leave the window first
+        expired = 0
+        while expired < len(state) and state[expired] < now - self.timeWindow:
+            expired += 1
+        excess = len(state) - expired + cost - self.rateLimit
+        if excess <= 0:
+            return 0.0
+        return state[expired + excess - 1] + self.timeWindow - now
+
+    def _counterRetryAfter(self, counter, now: float, cost: int) -> float:
+        position = now / self.timeWindow
+        window = int(position)
+        if counter.window == window:
+            prevCount, currCount = counter.prevCount, counter.currCount
+        elif counter.window == window - 1:
+            prevCount, currCount = counter.currCount, 0
+        else:
+            return 0.0
+        # allowed while prevCount * (1 - f) + currCount + cost - 1 < rateLimit, f = position within the window
+        room = self.rateLimit - currCount - cost + 1
+        if room <= 0:
+            # not before the next window, where this window's count becomes the previous one
+            window += 1
+            prevCount, room = currCount, self.rateLimit - cost + 1
+            if prevCount < room:
+                return window * self.timeWindow - now
+        elif prevCount * (window + 1 - position) < room:
+            return 0.0
+        return (window + 1 - room / prevCount) * self.timeWindow - now
+
+    def _addCounted(self, userName: str, now: float, cost: int) -> bool:
+        position = now / self.timeWindow  # in windows
+        window = int(position)
+        table = self.userDict
+        counter = table.current.get(userName) or table.get(userName)
+        if counter is None:
+            counter = _WindowCounter(window)
+            if not self.userDict.add(userName, counter):
+                return self.userDict.overflow == "allow"
+        elif counter.window != window:
+            # roll over; if a whole window went by without requests, the previous window is empty too
+            counter.prevCount = counter.currCount if counter.window == window - 1 else 0
+            counter.currCount = 0
+            counter.window = window
+
+        # share of the previous window that still overlaps the sliding window (now - timeWindow, now]
+        overlap = 1.0 - (position - window)
+        if counter.prevCount * overlap + counter.currCount + cost - 1 < self.rateLimit:
+            counter.currCount += cost
+            return True
+        return False
+
+
+class GCRALimiter:
+    """
+    Generic cell rate algorithm: rateLimit requests per timeWindow sustained, bursts of up to `burst` requests.
+    A request of cost n at time now is allowed if tat + n * interval - burst * interval <= now, where
+    tat = max(stored TAT, now) and interval = timeWindow / rateLimit; if allowed the stored TAT moves n intervals on.
+    A key whose TAT is in the past is indistinguishable from a new one, so such entries can be dropped any time.
+    """
+
+    def __init__(self, rateLimit: int, timeWindow: float, burst: int = None, clock=time.time,
+                 idleTimeout: float = None, maxKeys: int = None, overflow: str = "reject"):
+        """
+        :param rateLimit: Number requests
+        :param timeWindow: time period in secs
+        :param burst: requests allowed back to back after the key was idle, default rateLimit
+        :param clock: time source, seconds
+        :param idleTimeout, maxKeys, overflow: as for RateLimiter; idleTimeout defaults to the longest time
+            a TAT can lie ahead, max(timeWindow, burst * interval)
+        """
+        self.rateLimit = rateLimit
+        self.timeWindow = timeWindow
+        self.burst = rateLimit if burst is None else burst
+        self.interval = timeWindow / rateLimit  # seconds per request at the sustained rate
+        self.tolerance = self.burst * self.interval
+        if idleTimeout is None:
+            idleTimeout = max(timeWindow, self.tolerance)
+        # key -> theoretical arrival time
+        self.tatDict = _KeyTable(idleTimeout, lambda tat, now: tat <= now, maxKeys, overflow)
+        self.clock = clock
+
+    def allow(self, key: str, cost: int = 1) -> bool:
+        """
+        try to spend cost requests of key's allowance
+        :return: Request allowed or not; a denied request costs nothing
+        """
+        if cost < 1:
+            raise ValueError(f"cost must be at least 1, got {cost}")
+        if cost > self.burst:
+            raise ValueError(f"cost {cost} can never be allowed with burst {self.burst}")
+        now = self.clock()
+        tatDict = self.tatDict
+        if now >= tatDict.nextRotation or tatDict.draining:
+            tatDict.sweep(now)
+        tat = tatDict.current.get(key)
+        if tat is None:
+            tat = tatDict.get(key)
+        if tat is None:
+            if not tatDict.add(key, now):  # cost <= burst, so a new key's first request always fits
+                return tatDict.overflow == "allow"
+            tat = now
+        elif tat < now:
+            tat = now
+        newTat = tat + cost * self.interval
+        if newTat - self.tolerance > now:
+            return False
+        tatDict.current[key] = newTat  # get() / add() left the key in the current generation
+        return True
+
+    def retry_after(self, key: str, cost: int = 1) -> float:
+        """
+        :return: seconds until allow(key, cost) would succeed, 0.0 if it would succeed now,
+            math.inf if key is refused as over maxKeys
+        """
+        if cost < 1:
+            raise ValueError(f"cost must be at least 1, got {cost}")
+        if cost > self.burst:
+            raise ValueError(f"cost {cost} can never be allowed with burst {self.burst}")
+        now = self.clock()
+        tat = self.tatDict.get(key)
+        if tat is None and self.tatDict.rejectsNew():
+            return math.inf
+        tat = now if tat is None or tat < now else tat
+        return max(0.0, tat + cost * self.interval - self.tolerance - now)
+
+
+class ShardedRateLimiter:
+    """
+    Thread-safe limiter made of nStripes independent limiters, each guarded by its own lock.
+    - makeLimiter: callable() -> RateLimiter / GCRALimiter; called once per stripe, so per-limiter
+      settings such as maxKeys apply per stripe (pass maxKeys // nStripes for a global cap)
+    Same allow / addRequest / retry_after interface, so it also works under AsyncRateLimiter.
+    """
+
+    def __init__(self, makeLimiter, nStripes: int = 64):
+        self.stripes = [(threading.Lock(), makeLimiter()) for _ in range(nStripes)]
+
+    def allow(self, key: str, cost: int = 1) -> bool:
+        lock, limiter = self.stripes[hash(key) % len(self.stripes)]
+        with lock:
+            return limiter.allow(key, cost)
+
+    addRequest = allow
+
+    def retry_after(self, key: str, cost: int = 1) -> float:
+        lock, limiter = self.stripes[hash(key) % len(self.stripes)]
+        with lock:
+            return limiter.retry_after(key, cost)
+
+
+class AsyncRateLimiter:
+    """
+    asyncio front end for RateLimiter / GCRALimiter: acquire() waits for capacity instead of failing.
+    - requests of one key are served strictly FIFO: while any caller waits, newcomers queue behind it
+      even if their (smaller) cost would fit now
+    - per key with waiters there is one loop.call_later timer, set to retry_after of the queue head
+    - a cancelled waiter leaves the queue; if it was the head the timer is re-armed for the next one
+    - a key refused as over maxKeys (overflow="reject") has no retry time: its waiters fail with RuntimeError
+    The wrapped limiter may also be used directly (synchronously) at the same time.
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self._queues = {}  # key -> deque of (future, cost), only while someone waits
+        self._timers = {}  # key -> asyncio.TimerHandle for the queue head
+
+    async def acquire(self, key: str, cost: int = 1):
+        """Wait until cost requests of key are allowed, and spend them."""
+        queue = self._queues.get(key)
+        if queue is None:
+            if self.limiter.allow(key, cost):
+                return
+            queue = self._queues[key] = deque()
+        waiter = (asyncio.get_running_loop().create_future(), cost)
+        queue.append(waiter)
+        if len(queue) == 1:
+            self._schedule(key)
+        try:
+            await waiter[0]
+        except asyncio.CancelledError:
+            if waiter[0].done() and not waiter[0].cancelled():
+                raise  # granted in the same loop iteration as the cancel: the requests are spent
+            if queue and queue[0] is waiter:
+                queue.popleft()
+                self._timers.pop(key).cancel()
+                self._schedule(key)
+            # elsewhere in the queue it is skipped when it reaches the head
+            raise
+
+    def _schedule(self, key: str):
+        """Grant head waiters as long as they fit, then arm a timer for the next one."""
+        self._timers.pop(key, None)
+        queue = self._queues[key]
+        while queue:
+            future, cost = queue[0]
+            if future.cancelled():
+                queue.popleft()
+                continue
+            try:
+                granted = self.limiter.allow(key, cost)
+            except Exception as e:  # e.g. a cost that can never fit: fail this waiter, not the whole queue
+                queue.popleft()
+                future.set_exception(e)
+                continue
+            if granted:
+                queue.popleft()
+                future.set_result(None)
+            else:
+                delay = self.limiter.retry_after(key, cost)
+                if delay == math.inf:
+                    # over maxKeys: a slot opens only when other keys go idle, so there is nothing to wait for
+                    queue.popleft()
+                    future.set_exception(RuntimeError(f"key {key!r} is refused: the limiter is at maxKeys"))
+                    continue
+                delay = max(delay, MIN_DELAY)
+                self._timers[key] = asyncio.get_running_loop().call_later(delay, self._schedule, key)
+                return
+        del self._queues[key]
+
+
+if __name__ == "__main__":
+    rateLimitTest = RateLimiter(3, 5)
+
+    for i in range(15):
+        res = rateLimitTest.addRequest("user1")
+        print (f"{i=}, {res=}, time={time.time()}, len={len(rateLimitTest.userDict['user1'])}")
+        time.sleep (1)
+
+    # 3 requests per 5 seconds sustained, 2 of them back to back
+    gcra = GCRALimiter(3, 5, burst=2)
+    for i in range(8):
+        res = gcra.allow("user1")
+        print (f"{i=}, {res=}, retry_after={gcra.retry_after('user1'):.2f}s")
+        time.sleep (0.5)
+
+    # pace 12 outbound calls at 5 per second (burst 2), no polling
+    async def pacedCalls():
+        limiter = AsyncRateLimiter(GCRALimiter(5, 1, burst=2))
+        start = time.monotonic()
+
+        async def call(i):
+            await limiter.acquire("api")
+            print (f"call {i} at {time.monotonic() - start:.2f}s")
+
+        await asyncio.gather(*(call(i) for i in range(12)))
 
-for i in range(15):
-    res = rateLimitTest.addRequest("user1")
-    print (f"{i=}, {res=}, time={time.time()}, len={len(rateLimitTest.userDict['user1'])}")
-    time.sleep (1)
+    asyncio.run(pacedCalls())
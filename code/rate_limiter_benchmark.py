@@ -0,0 +1,223 @@
+"""
+Benchmarks for rate_limiter.py
+1. Accuracy of the approximate "counter" mode against the exact "log" mode on simulated traffic (virtual clock):
+   requests allowed by each, share of decisions that differ, and the most requests the counter let through within
+   any timeWindow (the exact limiter never exceeds rateLimit). Once the two modes disagree their windows drift
+   apart, so "decisions differ" overstates the error under overload; the totals and the peak are the better guide.
+   The "bunched" pattern is the known worst case: each window's requests arrive in its last tenth, so the next
+   window underestimates them.
+2. Memory per user at 1M active keys, measured with tracemalloc (dict entry included)
+3. Cost per decision of the log, counter and GCRA backends (real clock, 10,000 keys round robin, half denied)
+4. Idle-key eviction under scraping traffic (mostly never-repeating IDs, virtual clock): keys tracked at the end
+   and at most, time per decision, with the sweep effectively off, on, and with a maxKeys cap
+5. Threads: 1 - 32 threads hammering a shared set of keys through an unlocked RateLimiter, one global lock
+   (ShardedRateLimiter with 1 stripe) and 64 stripes. Correctness: the most requests any key got through must not
+   exceed rateLimit (the window is long enough that nothing expires). The thread switch interval is lowered
+   to make the unlocked check-then-append race show up quickly.
+"""
+import bisect
+import itertools
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+from rate_limiter import GCRALimiter, RateLimiter, ShardedRateLimiter
+
+N_KEYS = 1_000_000
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _arrivals(pattern, n_requests, rate_limit, time_window, rng):
+    """Request timestamps for one user; rates are relative to the limit (rate_limit per time_window)."""
+    if pattern.startswith("steady"):
+        load = float(pattern.split()[1].rstrip("x"))
+        t, rate = 0.0, load * rate_limit / time_window
+        for _ in range(n_requests):
+            t += rng.expovariate(rate)
+            yield t
+    elif pattern == "bursty":
+        # bursts of 0.5 - 2x the limit within a second, idle gaps in between
+        t, sent = 0.0, 0
+        while sent < n_requests:
+            t += rng.uniform(0.1, 1.5) * time_window
+            for _ in range(int(rate_limit * rng.uniform(0.5, 2))):
+                yield t + rng.random()
+                sent += 1
+            t += 1
+    elif pattern == "bunched":
+        window = 0
+        while True:
+            for _ in range(2 * rate_limit):
+                yield (window + 0.9 + rng.random() * 0.1) * time_window
+            window += 1
+            if window * 2 * rate_limit >= n_requests:
+                return
+
+
+def _peak(timestamps, time_window):
+    """Most timestamps within any half-open interval (t - time_window, t]."""
+    peak, first = 0, 0
+    for last, t in enumerate(timestamps):
+        first = bisect.bisect_right(timestamps, t - time_window, first, last)
+        peak = max(peak, last - first + 1)
+    return peak
+
+
+def bench_accuracy(patterns=("steady 0.8x", "steady 1.5x", "steady 5x", "bursty", "bunched"),
+                   rate_limit=100, time_window=60, n_requests=200_000, seed=0):
+    print(f"Counter vs log accuracy, rateLimit={rate_limit} per {time_window}s, {n_requests:,} requests per pattern")
+    for pattern in patterns:
+        arrivals = sorted(_arrivals(pattern, n_requests, rate_limit, time_window, random.Random(seed)))
+        allowed = {}
+        decisions = {}
+        for mode in ("log", "counter"):
+            clock = VirtualClock()
+            limiter = RateLimiter(rate_limit, time_window, mode=mode, clock=clock)
+            decided = []
+            for t in arrivals:
+                clock.now = t
+                decided.append(limiter.addRequest("user"))
+            decisions[mode] = decided
+            allowed[mode] = [t for t, ok in zip(arrivals, decided) if ok]
+        differ = sum(a != b for a, b in zip(decisions["log"], decisions["counter"])) / len(arrivals)
+        print(f"{pattern:>12}: allowed log {len(allowed['log']):>7,}, counter {len(allowed['counter']):>7,}, "
+              f"decisions differ {differ:.2%}, counter peak per window {_peak(allowed['counter'], time_window)} "
+              f"(limit {rate_limit})")
+
+
+def _traced_bytes(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used
+
+
+def bench_memory(n_keys=N_KEYS, rate_limit=1000, time_window=60):
+    print(f"Memory per user at {n_keys:,} active keys, rateLimit={rate_limit} per {time_window}s")
+    backends = {
+        "gcra": lambda: GCRALimiter(rate_limit, time_window).allow,
+        "counter": lambda: RateLimiter(rate_limit, time_window, mode="counter").addRequest,
+        "log": lambda: RateLimiter(rate_limit, time_window, mode="log").addRequest,
+    }
+    for name, make in backends.items():
+        def build():
+            add = make()
+            for i in range(n_keys):
+                add(f"user-{i}")
+            return add
+        used = _traced_bytes(build)
+        print(f"{name:>8}, 1 request per user: {used / n_keys:6.0f} bytes/user, {used / 2**20:,.0f} MiB in total")
+
+    # a user at the limit holds rate_limit timestamps; measured on fewer users and scaled to n_keys
+    sample = 1000
+
+    def build_full():
+        limiter = RateLimiter(rate_limit, time_window, mode="log")
+        for i in range(sample):
+            for _ in range(rate_limit):
+                limiter.addRequest(f"user-{i}")
+        return limiter
+    per_user = _traced_bytes(build_full) / sample
+    print(f"     log, user at the limit: {per_user:6,.0f} bytes/user, "
+          f"{per_user * n_keys / 2**30:,.1f} GiB for {n_keys:,} such users (extrapolated from {sample:,})")
+
+
+def bench_decision_cost(n_decisions=1_000_000, n_keys=10_000, rate_limit=50, time_window=60):
+    keys = [f"user-{i}" for i in range(n_keys)]
+    print(f"Cost per decision, {n_decisions:,} decisions over {n_keys:,} keys")
+    for name, add in (("log", RateLimiter(rate_limit, time_window, mode="log").addRequest),
+                      ("counter", RateLimiter(rate_limit, time_window, mode="counter").addRequest),
+                      ("gcra", GCRALimiter(rate_limit, time_window).allow)):
+        stream = itertools.islice(itertools.cycle(keys), n_decisions)
+        start = time.perf_counter()
+        allowed = sum(map(add, stream))
+        elapsed = time.perf_counter() - start
+        print(f"{name:>8}: {elapsed / n_decisions * 1e9:5.0f} ns/decision, {allowed:,} allowed")
+
+
+def bench_idle_eviction(n_decisions=1_000_000, rate=1000.0, scraper_share=0.9, n_users=1000, rate_limit=100,
+                        time_window=60, max_keys=50_000):
+    print(f"Idle-key eviction, {n_decisions:,} decisions at {rate:,.0f}/s (virtual), {scraper_share:.0%} from "
+          f"random IDs, rateLimit={rate_limit} per {time_window}s")
+    rng = random.Random(0)
+    keys = [f"scraper-{i}" if rng.random() < scraper_share else f"user-{rng.randrange(n_users)}"
+            for i in range(n_decisions)]
+    for name, options in (("no sweep", dict(idleTimeout=float("inf"))), ("sweep", {}),
+                          (f"sweep + maxKeys={max_keys:,} evict", dict(maxKeys=max_keys, overflow="evict"))):
+        for mode in ("log", "counter"):
+            clock = VirtualClock()
+            limiter = RateLimiter(rate_limit, time_window, mode=mode, clock=clock, **options)
+            peak = 0
+            start = time.perf_counter()
+            for i, key in enumerate(keys):
+                clock.now = i / rate
+                limiter.addRequest(key)
+                if not i % 1000:
+                    peak = max(peak, len(limiter.userDict))
+            elapsed = time.perf_counter() - start
+            print(f"{name:>28}, {mode:>7}: {len(limiter.userDict):>9,} keys tracked at the end, peak {peak:>9,}, "
+                  f"{limiter.userDict.evicted:>9,} evicted, {elapsed / n_decisions * 1e9:4.0f} ns/decision")
+
+
+def bench_threads(thread_counts=(1, 2, 4, 8, 16, 32), decisions_per_thread=50_000, n_keys=1000, rate_limit=100,
+                  time_window=3600):
+    print(f"Threads, {decisions_per_thread:,} decisions per thread over {n_keys:,} shared keys, "
+          f"rateLimit={rate_limit} per {time_window}s")
+    keys = [f"user-{i}" for i in range(n_keys)]
+    limiters = {
+        "unlocked": lambda: RateLimiter(rate_limit, time_window),
+        "global lock": lambda: ShardedRateLimiter(lambda: RateLimiter(rate_limit, time_window), nStripes=1),
+        "64 stripes": lambda: ShardedRateLimiter(lambda: RateLimiter(rate_limit, time_window), nStripes=64),
+    }
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for n_threads in thread_counts:
+            for name, make in limiters.items():
+                limiter = make()
+                allowed = [dict.fromkeys(keys, 0) for _ in range(n_threads)]
+                barrier = threading.Barrier(n_threads + 1)
+
+                def worker(tid):
+                    add, counts = limiter.addRequest, allowed[tid]
+                    stream = [keys[i % n_keys] for i in range(tid, tid + decisions_per_thread)]
+                    barrier.wait()
+                    for key in stream:
+                        if add(key):
+                            counts[key] += 1
+
+                threads = [threading.Thread(target=worker, args=(t,)) for t in range(n_threads)]
+                for t in threads: t.start()
+                start = time.perf_counter()
+                barrier.wait()
+                for t in threads: t.join()
+                elapsed = time.perf_counter() - start
+                worst = max(sum(counts[key] for counts in allowed) for key in keys)
+                print(f"{n_threads:>3} threads, {name:>11}: {n_threads * decisions_per_thread / elapsed / 1e3:6,.0f} "
+                      f"K decisions/s, max allowed per key {worst} ({'OK' if worst <= rate_limit else 'OVER LIMIT'})")
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+
+if __name__ == "__main__":
+    bench_accuracy()
+    print()
+    bench_memory()
+    print()
+    bench_decision_cost()
+    print()
+    bench_idle_eviction()
+    print()
+    bench_threads()
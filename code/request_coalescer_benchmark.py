@@ -0,0 +1,226 @@
+"""
+Benchmarks for REquestCoalescer.py
+1. Lock contention on the miss path: 1 / 8 / 64 threads, single in-flight lock (n_stripes=1) vs 64 stripes.
+   Every get is a miss on its own key, so each call registers, publishes and cleans up a flight.
+   Under the GIL the stripes mostly save lock hand-offs; on a free-threaded build they remove the serialization.
+2. Metrics overhead: cached get through the coalescer vs the bare cache lookup, and the cost of the miss-path
+   bookkeeping (two clock reads plus one or two histogram observations).
+3. Thundering herd: threads (or coroutines) requesting Zipf-distributed keys from an upstream with random latency
+   and injected errors, once per mode: no coalescing, plain coalescing (nothing cached), TTL cache,
+   TTL + stale-while-revalidate, TTL + XFetch refresh-ahead and TTL + negative caching of errors.
+   Reports upstream calls (and the reduction vs. one call per request), throughput, caller latency percentiles
+   and errors seen by callers. Seeded, so runs are comparable; tune the arguments to match production traffic.
+"""
+import asyncio
+import random
+import statistics
+import threading
+import time
+
+from REquestCoalescer import AsyncRequestCoalescer, CoalescerMetrics, RequestCoalescer, TTLCache
+
+GETS_PER_THREAD = 20_000
+
+
+def _identity(key: str) -> str:
+    return key
+
+
+def bench_contention(thread_counts=(1, 8, 64), stripe_counts=(1, 64), gets_per_thread=GETS_PER_THREAD):
+    print(f"Miss-path contention, {gets_per_thread:,} distinct-key gets per thread")
+    for n_threads in thread_counts:
+        for n_stripes in stripe_counts:
+            coalescer = RequestCoalescer(_identity, cache=TTLCache(maxsize=1024), n_stripes=n_stripes)
+            barrier = threading.Barrier(n_threads + 1)
+
+            def worker(tid: int):
+                keys = [f"{tid}-{i}" for i in range(gets_per_thread)]
+                barrier.wait()
+                for key in keys:
+                    coalescer.get(key)
+
+            threads = [threading.Thread(target=worker, args=(t,)) for t in range(n_threads)]
+            for t in threads: t.start()
+            start = time.perf_counter()
+            barrier.wait()
+            for t in threads: t.join()
+            elapsed = time.perf_counter() - start
+            total = n_threads * gets_per_thread
+            print(f"{n_threads:>3} threads, {n_stripes:>2} stripe(s): {total / elapsed / 1e3:,.0f} K gets/s, "
+                  f"{elapsed / total * 1e6:.2f} us/get")
+
+
+def bench_metrics_overhead(n_gets=1_000_000):
+    cache = TTLCache()
+    coalescer = RequestCoalescer(_identity, cache=cache)
+    coalescer.get("hot")
+    cache_get, coalescer_get = cache.get, coalescer.get
+
+    start = time.perf_counter()
+    for _ in range(n_gets):
+        cache_get("hot")
+    bare = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(n_gets):
+        coalescer_get("hot")
+    full = time.perf_counter() - start
+
+    # what a miss adds on top of the fetch itself: the fetcher records fetch latency and waiters per flight,
+    # a waiter records its wait latency; both read the clock twice
+    metrics = CoalescerMetrics()
+    clock = time.monotonic
+    start = time.perf_counter()
+    for _ in range(n_gets):
+        t = clock()
+        metrics.misses += 1
+        metrics.fetch_latency.observe(clock() - t)
+        metrics.waiters_per_flight.observe(3)
+    fetcher = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(n_gets):
+        t = clock()
+        metrics.misses += 1
+        metrics.wait_latency.observe(clock() - t)
+    waiter = time.perf_counter() - start
+
+    print(f"Metrics overhead, {n_gets:,} calls")
+    print(f"cached get: bare TTLCache.get {bare / n_gets * 1e9:.0f} ns, RequestCoalescer.get {full / n_gets * 1e9:.0f} ns "
+          f"(+{(full - bare) / n_gets * 1e9:.0f} ns incl. the method call and hit counter)")
+    print(f"miss-path bookkeeping: {fetcher / n_gets * 1e9:.0f} ns per fetcher, {waiter / n_gets * 1e9:.0f} ns per waiter "
+          f"(loop overhead included)")
+
+
+# modes of the herd benchmark: name -> RequestCoalescer / AsyncRequestCoalescer options (None = call upstream directly);
+# the TTL is kept well below the run time so entries expire, which is where stale and XFetch differ from plain TTL
+HERD_MODES = {
+    "no coalescing": None,
+    "coalesce only": dict(ttl=0),
+    "ttl": dict(ttl=0.1),
+    "ttl + stale": dict(ttl=0.1, grace=1, serve_stale=True),
+    "ttl + xfetch": dict(ttl=0.1, refresh_ahead_beta=1.0),
+    "ttl + error_ttl": dict(ttl=0.1, error_ttl=0.05),
+}
+
+
+def zipf_keys(n_requests, n_keys=10_000, s=1.1, seed=0):
+    """Reproducible request stream: key i (0 = hottest) is requested with probability proportional to 1 / (i + 1)**s."""
+    rng = random.Random(seed)
+    cum_weights, total = [], 0.0
+    for i in range(n_keys):
+        total += 1 / (i + 1) ** s
+        cum_weights.append(total)
+    return [f"key-{i}" for i in rng.choices(range(n_keys), cum_weights=cum_weights, k=n_requests)]
+
+
+class Upstream:
+    """Simulated upstream: lognormal latency around `median` seconds, raises ConnectionError with error_rate."""
+    def __init__(self, median=0.005, sigma=0.5, error_rate=0.0, seed=0):
+        self.median = median
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    def _latency(self):
+        self.calls += 1
+        if self.rng.random() < self.error_rate:
+            raise ConnectionError("injected upstream error")
+        return self.rng.lognormvariate(0, self.sigma) * self.median
+
+    def fetch(self, key):
+        time.sleep(self._latency())
+        return f"value-for-{key}"
+
+    async def fetch_async(self, key):
+        await asyncio.sleep(self._latency())
+        return f"value-for-{key}"
+
+
+def _make_coalescer(cls, fetch, options):
+    options = dict(options)
+    cache = TTLCache(maxsize=100_000, ttl=options.pop("ttl"), grace=options.pop("grace", 0.0))
+    return cls(fetch, cache=cache, **options)
+
+
+def _report(mode, n_requests, elapsed, latencies, errors, upstream_calls):
+    q = statistics.quantiles(latencies, n=100)
+    print(f"{mode:>16}: {upstream_calls:>6} upstream calls ({n_requests / max(upstream_calls, 1):6.1f}x fewer), "
+          f"{n_requests / elapsed:>8,.0f} req/s, latency ms p50 {q[49] * 1e3:6.2f} p90 {q[89] * 1e3:6.2f} "
+          f"p99 {q[98] * 1e3:6.2f} max {max(latencies) * 1e3:7.2f}, errors {errors}")
+
+
+def bench_herd(n_threads=64, requests_per_thread=500, n_keys=10_000, zipf_s=1.1, median=0.005, sigma=0.5,
+               error_rate=0.01, modes=HERD_MODES, seed=0):
+    n_requests = n_threads * requests_per_thread
+    print(f"Thundering herd, {n_threads} threads x {requests_per_thread} requests, Zipf(s={zipf_s}) over "
+          f"{n_keys:,} keys, upstream median {median * 1e3:.1f} ms (sigma {sigma}), {error_rate:.0%} errors")
+    streams = [zipf_keys(requests_per_thread, n_keys, zipf_s, seed + t) for t in range(n_threads)]
+    for mode, options in modes.items():
+        upstream = Upstream(median, sigma, error_rate, seed)
+        get = upstream.fetch if options is None else _make_coalescer(RequestCoalescer, upstream.fetch, options).get
+        latencies = [[] for _ in range(n_threads)]
+        errors = [0] * n_threads
+        barrier = threading.Barrier(n_threads + 1)
+
+        def worker(tid):
+            times = latencies[tid]
+            barrier.wait()
+            for key in streams[tid]:
+                start = time.perf_counter()
+                try:
+                    get(key)
+                except ConnectionError:
+                    errors[tid] += 1
+                times.append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=worker, args=(t,)) for t in range(n_threads)]
+        for t in threads: t.start()
+        start = time.perf_counter()
+        barrier.wait()
+        for t in threads: t.join()
+        elapsed = time.perf_counter() - start
+        _report(mode, n_requests, elapsed, [x for times in latencies for x in times], sum(errors), upstream.calls)
+
+
+def bench_herd_async(n_coroutines=1000, requests_per_coroutine=50, n_keys=10_000, zipf_s=1.1, median=0.005,
+                     sigma=0.5, error_rate=0.01, modes=HERD_MODES, seed=0):
+    n_requests = n_coroutines * requests_per_coroutine
+    print(f"Thundering herd (asyncio), {n_coroutines} coroutines x {requests_per_coroutine} requests, "
+          f"Zipf(s={zipf_s}) over {n_keys:,} keys, upstream median {median * 1e3:.1f} ms, {error_rate:.0%} errors")
+    streams = [zipf_keys(requests_per_coroutine, n_keys, zipf_s, seed + c) for c in range(n_coroutines)]
+
+    async def run(get):
+        latencies, errors = [], 0
+
+        async def client(stream):
+            nonlocal errors
+            for key in stream:
+                start = time.perf_counter()
+                try:
+                    await get(key)
+                except ConnectionError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(stream) for stream in streams))
+        return time.perf_counter() - start, latencies, errors
+
+    for mode, options in modes.items():
+        upstream = Upstream(median, sigma, error_rate, seed)
+        get = (upstream.fetch_async if options is None
+               else _make_coalescer(AsyncRequestCoalescer, upstream.fetch_async, options).get)
+        elapsed, latencies, errors = asyncio.run(run(get))
+        _report(mode, n_requests, elapsed, latencies, errors, upstream.calls)
+
+
+if __name__ == "__main__":
+    bench_contention()
+    print()
+    bench_metrics_overhead()
+    print()
+    bench_herd()
+    print()
+    bench_herd_async()